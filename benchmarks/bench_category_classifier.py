@@ -0,0 +1,91 @@
+"""
+Accuracy of the local category classifier on the stored labeled examples, and
+the LLM category calls and tokens it saves.
+
+Every example in the category_examples collection (see
+`python category_classifier.py`) is classified leave-one-out against all the
+others. Per confidence threshold the report shows how many requests would be
+answered locally, how accurate those answers are, and the category calls,
+tokens and cost saved per 1000 image requests. Latency is not saved: the
+category call runs concurrently with the slower image-generation call.
+
+Run from the repository root (uses MONGO_URI):
+    python benchmarks/bench_category_classifier.py [--tokens-per-call 450]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from category_classifier import K_NEIGHBOURS, KNNClassifier
+from database import db
+
+
+async def load_examples() -> KNNClassifier:
+    classifier = KNNClassifier()
+    async for example in db["category_examples"].find({}):
+        classifier.add(example["_id"], example["features"], example["category"])
+    return classifier
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--tokens-per-call",
+        type=int,
+        default=450,
+        help="Prompt + output tokens of one LLM category call (image included)",
+    )
+    parser.add_argument(
+        "--usd-per-million-tokens",
+        type=float,
+        default=0.30,
+        help="Blended token price of the category model",
+    )
+    args = parser.parse_args()
+
+    classifier = asyncio.run(load_examples())
+    examples = dict(classifier.examples)
+    if len(examples) <= K_NEIGHBOURS:
+        sys.exit(f"Only {len(examples)} labeled examples; store more first")
+
+    predictions = []
+    start = time.perf_counter()
+    for key, (features, category) in examples.items():
+        # Leave the example out of its own neighbourhood
+        del classifier.examples[key]
+        predicted, confidence = classifier.predict(features)
+        classifier.examples[key] = (features, category)
+        predictions.append((category, predicted, confidence))
+    local_ms = (time.perf_counter() - start) / len(examples) * 1000
+
+    counts = Counter(category for category, _, _ in predictions)
+    print(
+        f"{len(examples)} labeled examples ({dict(counts)}), "
+        f"leave-one-out, {local_ms:.2f} ms/prediction"
+    )
+    print(
+        f"{'threshold':>9} {'coverage':>9} {'accuracy':>9} "
+        f"{'calls/1k':>9} {'tokens/1k':>10} {'usd/1k':>7} {'wrong/1k':>9}"
+    )
+    for threshold in (0.5, 0.6, 0.7, 0.8, 0.9, 0.95):
+        answered = [(c, p) for c, p, conf in predictions if conf >= threshold]
+        coverage = len(answered) / len(predictions)
+        accuracy = sum(c == p for c, p in answered) / len(answered) if answered else 0
+        calls = coverage * 1000
+        tokens = calls * args.tokens_per_call
+        wrong = calls * (1 - accuracy)
+        print(
+            f"{threshold:>9.2f} {coverage:>9.1%} {accuracy:>9.1%} {calls:>9.0f} "
+            f"{tokens:>10.0f} {tokens * args.usd_per_million_tokens / 1e6:>7.3f} "
+            f"{wrong:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
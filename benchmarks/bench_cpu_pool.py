@@ -0,0 +1,71 @@
+"""
+Throughput of the CPU pool for the image work the server offloads per
+request: preparing a non-JPEG/PNG/WebP upload for the model (decode + JPEG
+encode; supported uploads are sent as-is) and base64 of the generated images.
+
+Run from the repository root:
+    python benchmarks/bench_cpu_pool.py [--kind process|thread] [--tasks 64]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+import workers
+from image_store import encode_data_uris, encode_for_model
+
+
+def request_work(image_data: bytes, generated: bytes) -> int:
+    """The CPU part of one generation request, as server.py offloads it"""
+    model_input = encode_for_model(image_data)
+    return len(model_input) + sum(
+        len(uri) for uri in encode_data_uris([(generated, "image/png")] * 3)
+    )
+
+
+def sample_image(width: int = 1600, height: int = 1200, fmt: str = "BMP") -> bytes:
+    image = Image.effect_noise((width, height), 64).convert("RGB")
+    buffer = BytesIO()
+    image.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+async def run(tasks: int, image_data: bytes, generated: bytes) -> float:
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(workers.run_cpu(request_work, image_data, generated) for _ in range(tasks))
+    )
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--kind", default="process", choices=["process", "thread"])
+    parser.add_argument("--tasks", type=int, default=64)
+    args = parser.parse_args()
+
+    image_data = sample_image()
+    generated = sample_image(1024, 1024, "PNG")
+    cores = os.cpu_count() or 1
+    sizes = sorted({1, 2, 4, 8, cores} & set(range(1, cores + 1)))
+    baseline = None
+    print(f"{args.kind} pool, {args.tasks} requests, {len(image_data)} byte BMP upload")
+    print(f"{'workers':>8} {'req/s':>10} {'speedup':>8}")
+    for size in sizes:
+        workers.configure(kind=args.kind, workers=size, queue=args.tasks)
+        asyncio.run(run(size, image_data, generated))  # warm up the pool
+        elapsed = asyncio.run(run(args.tasks, image_data, generated))
+        throughput = args.tasks / elapsed
+        baseline = baseline or throughput
+        print(f"{size:>8} {throughput:>10.1f} {throughput / baseline:>7.2f}x")
+    workers.shutdown()
+
+
+if __name__ == "__main__":
+    main()
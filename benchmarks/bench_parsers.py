@@ -0,0 +1,169 @@
+"""
+Checks every response parser in parsers.PARSERS against the recorded corpus
+of raw model outputs, then compares their throughput.
+
+Each corpus line is {"id", "kind", "args", "text", "expected"}. A parser must
+reproduce "expected" exactly and keep the structural guarantees the API
+promises (three non-empty stories, capped tag counts, flat hashtags, ...).
+
+Run from the repository root:
+    python benchmarks/bench_parsers.py [--seconds 1.0]
+    python benchmarks/bench_parsers.py --add captured.jsonl
+    python benchmarks/bench_parsers.py --record
+
+--add merges outputs captured with PARSER_CORPUS_FILE into the corpus
+(skipping texts already present) and records their expected results with the
+reference parser; --record re-records every expected result the same way.
+Exits non-zero if any parser disagrees with the corpus.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parsers
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parser_corpus.jsonl")
+
+
+def load(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save(path: str, cases: list):
+    with open(path, "w", encoding="utf-8") as f:
+        for case in cases:
+            f.write(json.dumps(case, ensure_ascii=False) + "\n")
+
+
+def run(parser, case: dict):
+    return getattr(parser, case["kind"])(case["text"], **case.get("args", {}))
+
+
+def _items(value, most: int) -> list:
+    problems = []
+    if not isinstance(value, list):
+        return [f"expected a list, got {type(value).__name__}"]
+    if len(value) > most:
+        problems.append(f"{len(value)} items, at most {most} allowed")
+    if not all(isinstance(item, str) and item.strip() for item in value):
+        problems.append("empty or non-string item")
+    return problems
+
+
+def _hashtags(value: list) -> list:
+    problems = _items(value, parsers.HASHTAG_COUNT)
+    if any("," in tag or len(tag.split()) != 1 for tag in value):
+        problems.append("hashtags not split into single tags")
+    return problems
+
+
+def structural_problems(kind: str, args: dict, result) -> list:
+    """Guarantees the API makes whatever the model wrote"""
+    if kind == "product_names":
+        return _items(result, len(result) if isinstance(result, list) else 0)
+    if kind == "titles":
+        return _items(result, parsers.TITLE_COUNT)
+    if kind == "stories":
+        problems = _items(result, parsers.STORY_COUNT)
+        if isinstance(result, list) and len(result) != parsers.STORY_COUNT:
+            problems.append(f"{len(result)} stories, exactly 3 required")
+        return problems
+    if kind == "tags_captions":
+        if not isinstance(result, dict):
+            return ["expected a dict"]
+        return (
+            _items(result.get("seo_tags"), parsers.SEO_TAG_COUNT)
+            + _hashtags(result.get("hashtags"))
+            + _items(result.get("captions"), parsers.CAPTION_COUNT)
+        )
+    if kind == "regenerated":
+        field = args["field"]
+        if field in parsers.SINGLE_VARIANT_FIELDS:
+            return [] if isinstance(result, str) else ["expected a string"]
+        if field == "hashtags":
+            return _hashtags(result)
+        return _items(result, parsers.TAG_COUNTS[field])
+    return [f"unknown kind {kind!r}"]
+
+
+def check(cases: list) -> int:
+    failures = 0
+    for name, parser in parsers.PARSERS.items():
+        for case in cases:
+            try:
+                result = run(parser, case)
+            except Exception as e:
+                result, problems = None, [f"raised {e!r}"]
+            else:
+                problems = structural_problems(
+                    case["kind"], case.get("args", {}), result
+                )
+                if result != case["expected"]:
+                    problems.append(f"expected {case['expected']!r}, got {result!r}")
+            for problem in problems:
+                print(f"FAIL {name} {case['id']}: {problem}")
+            failures += bool(problems)
+    print(f"{len(cases)} cases x {len(parsers.PARSERS)} parsers, {failures} failures")
+    return failures
+
+
+def throughput(cases: list, seconds: float):
+    size = sum(len(case["text"].encode()) for case in cases)
+    print(f"{'parser':>12} {'outputs/s':>10} {'MB/s':>7} {'speedup':>8}")
+    baseline = None
+    for name, parser in parsers.PARSERS.items():
+        rounds = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            for case in cases:
+                run(parser, case)
+            rounds += 1
+        elapsed = time.perf_counter() - start
+        rate = rounds * len(cases) / elapsed
+        baseline = baseline or rate
+        print(
+            f"{name:>12} {rate:>10.0f} {rounds * size / elapsed / 1e6:>7.1f} "
+            f"{rate / baseline:>7.2f}x"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", default=CORPUS)
+    parser.add_argument("--seconds", type=float, default=1.0)
+    parser.add_argument("--add", metavar="FILE", help="captured outputs to merge")
+    parser.add_argument("--record", action="store_true")
+    args = parser.parse_args()
+
+    cases = load(args.corpus) if os.path.exists(args.corpus) else []
+    if args.add or args.record:
+        reference = parsers.PARSERS["reference"]
+        seen = {(c["kind"], json.dumps(c.get("args", {})), c["text"]) for c in cases}
+        for captured in load(args.add) if args.add else []:
+            key = (
+                captured["kind"],
+                json.dumps(captured.get("args", {})),
+                captured["text"],
+            )
+            if key not in seen:
+                seen.add(key)
+                cases.append({"id": f"captured-{len(cases)}", **captured})
+        for case in cases:
+            if args.record or "expected" not in case:
+                case["expected"] = run(reference, case)
+        save(args.corpus, cases)
+        print(f"recorded {len(cases)} cases to {args.corpus}")
+
+    failures = check(cases)
+    throughput(cases, args.seconds)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Query latency of the in-process product search index on a synthetic catalogue
+(the fallback used when Mongo text search is unavailable).
+
+Run from the repository root:
+    python benchmarks/bench_search.py [--products 100000] [--queries 200]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from product_search import InvertedIndex
+
+CATEGORIES = [
+    "textile",
+    "pottery",
+    "furniture",
+    "jewellery",
+    "decorative work",
+    "home utilities",
+]
+LOCATIONS = [f"town {i}" for i in range(200)]
+WORDS = [
+    "handmade",
+    "handwoven",
+    "clay",
+    "terracotta",
+    "brass",
+    "silver",
+    "teak",
+    "cotton",
+    "silk",
+    "indigo",
+    "block",
+    "printed",
+    "carved",
+    "painted",
+    "glazed",
+    "rustic",
+    "heritage",
+    "festive",
+    "bridal",
+    "village",
+    "artisan",
+    "traditional",
+    "modern",
+    "vase",
+    "bowl",
+    "lamp",
+    "shawl",
+    "saree",
+    "necklace",
+    "earrings",
+    "chair",
+    "table",
+    "basket",
+    "rug",
+    "mirror",
+] + [f"motif{i}" for i in range(2000)]
+
+
+def product(rng: random.Random, i: int) -> dict:
+    def text(n: int) -> str:
+        return " ".join(rng.choice(WORDS) for _ in range(n))
+
+    return {
+        "_id": i,
+        "name": text(3),
+        "title": text(6),
+        "story": text(80),
+        "caption": text(12),
+        "hashtags": [f"#{rng.choice(WORDS)}" for _ in range(6)],
+        "seo_tags": [rng.choice(WORDS) for _ in range(5)],
+        "category": rng.choice(CATEGORIES),
+        "location": rng.choice(LOCATIONS),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    index = InvertedIndex()
+    start = time.perf_counter()
+    for i in range(args.products):
+        index.add(product(rng, i))
+    print(f"indexed {args.products} products in {time.perf_counter() - start:.1f}s")
+
+    cases = {
+        "common term": lambda: ("handmade", {}),
+        "two terms": lambda: (f"{rng.choice(WORDS)} {rng.choice(WORDS)}", {}),
+        "rare term": lambda: (f"motif{rng.randrange(2000)}", {}),
+        "term + category": lambda: (
+            rng.choice(WORDS[:35]),
+            {"category": rng.choice(CATEGORIES)},
+        ),
+        "browse + facets": lambda: (
+            "",
+            {"category": rng.choice(CATEGORIES), "location": rng.choice(LOCATIONS)},
+        ),
+    }
+    print(f"{'query':>16} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for name, make in cases.items():
+        timings = []
+        for _ in range(args.queries):
+            query, filters = make()
+            start = time.perf_counter()
+            index.search(query, filters, skip=rng.choice([0, 20, 200]), limit=20)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        print(
+            f"{name:>16} {statistics.median(timings):>8.1f} {p95:>8.1f} "
+            f"{timings[-1]:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
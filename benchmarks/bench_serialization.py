@@ -0,0 +1,89 @@
+"""
+Serialization cost of typical responses: FastAPI's default encoder
+(jsonable_encoder + json.dumps), Pydantic's model_dump_json, and the
+orjson-based ORJSONResponse used as the app's default response class.
+
+Run from the repository root:
+    python benchmarks/bench_serialization.py
+"""
+import base64
+import json
+import os
+import sys
+import timeit
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from modelsDB import ImagesNameCategoryContent, StoriesContent, TitlesContent
+from responses import ORJSONResponse
+
+STORY = "A handwoven basket from the hills of Assam, shaped by patient hands. " * 40
+
+
+def payloads():
+    image_uri = "data:image/png;base64," + base64.b64encode(os.urandom(1_500_000)).decode()
+    products = [
+        {
+            "_id": ObjectId(),
+            "name": f"Product {i}",
+            "category": "pottery",
+            "location": "Khurja",
+            "description": STORY[:400],
+            "title": "Hand-Painted Blue Pottery Vase",
+            "story": STORY,
+            "caption": STORY[:200],
+            "hashtags": ["#handmade", "#pottery", "#artisan"],
+            "seo_tags": ["handmade blue pottery vase from Khurja"] * 5,
+            "image_id": "a" * 64,
+            "timestamp": datetime.utcnow(),
+        }
+        for i in range(500)
+    ]
+    return {
+        "titles": TitlesContent(
+            success=True, data={"titles": ["Handwoven Bamboo Basket"] * 3}, message="ok"
+        ),
+        "stories": StoriesContent(
+            success=True, data={"stories": [STORY] * 3}, message="ok"
+        ),
+        "images": ImagesNameCategoryContent(
+            success=True,
+            data={"images": [image_uri] * 3, "titles": ["Blue Vase"] * 3, "category": "pottery"},
+            message="ok",
+        ),
+        "products (500)": {"status": "success", "products": products},
+    }
+
+
+def stdlib(content):
+    return json.dumps(jsonable_encoder(content, custom_encoder={ObjectId: str})).encode()
+
+
+def pydantic_json(content):
+    return content.model_dump_json().encode()
+
+
+def orjson_response(content):
+    if hasattr(content, "model_dump"):
+        content = content.model_dump()
+    return ORJSONResponse(content).body
+
+
+def main():
+    print(f"{'payload':<16} {'encoder':<18} {'ms/op':>10}")
+    for name, content in payloads().items():
+        encoders = [("jsonable+json", stdlib), ("orjson", orjson_response)]
+        if hasattr(content, "model_dump_json"):
+            encoders.insert(1, ("model_dump_json", pydantic_json))
+        for label, encode in encoders:
+            runs = 5 if "images" in name or "products" in name else 200
+            seconds = timeit.timeit(lambda: encode(content), number=runs) / runs
+            print(f"{name:<16} {label:<18} {seconds * 1000:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Throughput of /gen-titles as the number of uvicorn workers grows, with Mongo
+and Gemini replaced by the in-memory fakes in benchmarks/fakes.py.
+
+Every request has a distinct title so neither the similarity cache nor
+single-flight collapses them. Scaling flattens once workers exceed cores.
+
+Run from the repository root:
+    python benchmarks/bench_workers.py [--workers 1 2 4] [--seconds 10]
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int, workers: int) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "SIMILARITY_CACHE": "false",
+        "CPU_POOL_KIND": "thread",
+    }
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "fakes:create_app",
+            "--factory",
+            "--app-dir",
+            BENCH_DIR,
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+            "--log-level",
+            "warning",
+        ],
+        env=env,
+    )
+
+
+def wait_ready(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{url}/health").status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+async def _load(url: str, client_id: int, concurrency: int, seconds: float) -> int:
+    deadline = time.monotonic() + seconds
+    done = 0
+
+    async def user(user_id: int):
+        nonlocal done
+        async with httpx.AsyncClient(base_url=url, timeout=30) as http:
+            n = 0
+            while time.monotonic() < deadline:
+                response = await http.post(
+                    "/gen-titles",
+                    data={
+                        "user_title": f"clay pot {client_id}-{user_id}-{n}",
+                        "category": "pottery",
+                        "location": "Jaipur",
+                    },
+                )
+                response.raise_for_status()
+                done += 1
+                n += 1
+
+    await asyncio.gather(*(user(i) for i in range(concurrency)))
+    return done
+
+
+def load_process(url: str, client_id: int, concurrency: int, seconds: float) -> int:
+    return asyncio.run(_load(url, client_id, concurrency, seconds))
+
+
+def measure(url: str, clients: int, concurrency: int, seconds: float) -> float:
+    with multiprocessing.Pool(clients) as pool:
+        counts = pool.starmap(
+            load_process,
+            [(url, i, concurrency, seconds) for i in range(clients)],
+        )
+    return sum(counts) / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=None)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--clients", type=int, default=2, help="load processes")
+    parser.add_argument("--concurrency", type=int, default=32, help="per client")
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    sizes = args.workers or sorted({1, 2, 4, cores})
+    print(f"{cores} cores, {args.clients}x{args.concurrency} concurrent clients")
+    print(f"{'workers':>8} {'req/s':>10} {'speedup':>8}")
+    baseline = None
+    for size in sizes:
+        port = free_port()
+        url = f"http://127.0.0.1:{port}"
+        server = start_server(port, size)
+        try:
+            wait_ready(url)
+            measure(url, args.clients, args.concurrency, 1)  # warm up
+            throughput = measure(url, args.clients, args.concurrency, args.seconds)
+        finally:
+            server.terminate()
+            server.wait()
+        baseline = baseline or throughput
+        print(f"{size:>8} {throughput:>10.1f} {throughput / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
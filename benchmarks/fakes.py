@@ -0,0 +1,350 @@
+"""
+In-memory stand-ins for Mongo and the Gemini client, so the server can be
+load-tested without network access. Only the calls the server makes are
+implemented.
+
+    uvicorn fakes:create_app --factory --app-dir benchmarks
+
+FAKE_GEMINI_LATENCY sets the simulated model latency in seconds (default 0.05).
+For production-like replies and latency, run with GEMINI_MODE=replay and a
+file recorded against Gemini (see model_recorder).
+"""
+
+import asyncio
+import copy
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from google.genai import types
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+GEMINI_LATENCY = float(os.getenv("FAKE_GEMINI_LATENCY", 0.05))
+
+
+def _get(doc, key):
+    for part in key.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(part)
+    return doc
+
+
+def _matches(doc, query) -> bool:
+    for key, expected in (query or {}).items():
+        value = _get(doc, key)
+        if isinstance(expected, dict) and any(k.startswith("$") for k in expected):
+            for op, arg in expected.items():
+                if op == "$exists" and (value is not None) != arg:
+                    return False
+                if op == "$in" and value not in arg:
+                    return False
+                if op == "$nin" and value in arg:
+                    return False
+                if op == "$ne" and value == arg:
+                    return False
+        elif value != expected:
+            return False
+    return True
+
+
+def _evaluate(doc, expression):
+    """The few aggregation expressions used in update pipelines"""
+    if isinstance(expression, dict) and "$ifNull" in expression:
+        for option in expression["$ifNull"]:
+            value = _evaluate(doc, option)
+            if value is not None:
+                return value
+        return None
+    if expression == "$$NOW":
+        return datetime.utcnow()
+    if isinstance(expression, str) and expression.startswith("$"):
+        return _get(doc, expression[1:])
+    return expression
+
+
+def _text_score(doc, search: str) -> float:
+    """Stand-in for a text index: query words found in any string field"""
+    words = set(search.lower().split())
+    text = " ".join(
+        " ".join(map(str, v)) if isinstance(v, list) else v
+        for v in doc.values()
+        if isinstance(v, (str, list))
+    ).lower()
+    return float(sum(word in text for word in words))
+
+
+def _sort(docs, order):
+    for key, direction in reversed(list(order.items())):
+        docs.sort(
+            key=lambda d: (_get(d, key) is not None, _get(d, key)),
+            reverse=direction < 0,
+        )
+    return docs
+
+
+def _aggregate(docs, pipeline):
+    """The aggregation stages product search uses"""
+    for stage in pipeline:
+        ((op, arg),) = stage.items()
+        if op == "$match":
+            arg = dict(arg)
+            text = arg.pop("$text", None)
+            if text is not None:
+                scored = [(d, _text_score(d, text["$search"])) for d in docs]
+                docs = [{**d, "_text_score": score} for d, score in scored if score]
+            docs = [d for d in docs if _matches(d, arg)]
+        elif op == "$addFields":
+            docs = [
+                {
+                    **d,
+                    **{
+                        k: (
+                            d.get("_text_score", 0.0)
+                            if v == {"$meta": "textScore"}
+                            else v
+                        )
+                        for k, v in arg.items()
+                    },
+                }
+                for d in docs
+            ]
+        elif op == "$sort":
+            docs = _sort(list(docs), arg)
+        elif op == "$skip":
+            docs = docs[arg:]
+        elif op == "$limit":
+            docs = docs[:arg]
+        elif op == "$project":
+            docs = [_project(d, arg) for d in docs]
+        elif op == "$count":
+            docs = [{arg: len(docs)}] if docs else []
+        elif op == "$group":
+            counts = {}
+            for d in docs:
+                key = _evaluate(d, arg["_id"])
+                counts[key] = counts.get(key, 0) + 1
+            docs = [{"_id": key, "count": count} for key, count in counts.items()]
+        elif op == "$facet":
+            docs = [{name: _aggregate(docs, sub) for name, sub in arg.items()}]
+        else:
+            raise NotImplementedError(f"Fake aggregate has no {op} stage")
+    return [{k: v for k, v in d.items() if k != "_text_score"} for d in docs]
+
+
+def _project(doc, projection):
+    doc = copy.deepcopy(doc)
+    if not projection:
+        return doc
+    if not any(projection.values()):
+        return {k: v for k, v in doc.items() if k not in projection}
+    keep = {k for k, v in projection.items() if v} | {"_id"}
+    return {k: v for k, v in doc.items() if k in keep}
+
+
+class _Result:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def sort(self, key, direction=1):
+        self._docs.sort(key=lambda d: str(_get(d, key)), reverse=direction < 0)
+        return self
+
+    def skip(self, count):
+        self._docs = self._docs[count:]
+        return self
+
+    def limit(self, count):
+        if count:
+            self._docs = self._docs[:count]
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    async def to_list(self, length=None):
+        return self._docs[:length] if length else list(self._docs)
+
+    def __aiter__(self):
+        self._iter = iter(self._docs)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = []
+
+    async def create_index(self, *args, **kwargs):
+        return "index"
+
+    def find(self, query=None, projection=None, **kwargs):
+        return FakeCursor(
+            [_project(d, projection) for d in self.docs if _matches(d, query)]
+        )
+
+    async def find_one(self, query=None, projection=None, **kwargs):
+        for doc in self.docs:
+            if _matches(doc, query):
+                return _project(doc, projection)
+        return None
+
+    def aggregate(self, pipeline):
+        return FakeCursor(_aggregate([copy.deepcopy(d) for d in self.docs], pipeline))
+
+    async def find_one_and_update(
+        self, query, update, projection=None, upsert=False, return_document=False
+    ):
+        for doc in self.docs:
+            if _matches(doc, query):
+                before = _project(doc, projection)
+                self._apply(doc, update)
+                # ReturnDocument.AFTER is True
+                return _project(doc, projection) if return_document else before
+        if upsert:
+            result = await self.update_one(query, update, upsert=True)
+            if return_document:
+                return await self.find_one({"_id": result.upserted_id}, projection)
+        return None
+
+    async def insert_one(self, doc):
+        doc.setdefault("_id", ObjectId())
+        self.docs.append(copy.deepcopy(doc))
+        return _Result(inserted_id=doc["_id"])
+
+    async def insert_many(self, docs, ordered=True):
+        return _Result(
+            inserted_ids=[(await self.insert_one(d)).inserted_id for d in docs]
+        )
+
+    async def bulk_write(self, requests, ordered=True):
+        """UpdateOne requests only, as the catalogue import sends"""
+        counts = {"nMatched": 0, "nUpserted": 0}
+        write_errors = []
+        for index, request in enumerate(requests):
+            try:
+                result = await self.update_one(
+                    request._filter, request._doc, upsert=request._upsert
+                )
+            except DuplicateKeyError as e:
+                write_errors.append({"index": index, "code": e.code, "errmsg": str(e)})
+                if ordered:
+                    break
+                continue
+            counts["nMatched"] += result.matched_count
+            counts["nUpserted"] += result.upserted_id is not None
+        if write_errors:
+            raise BulkWriteError({**counts, "writeErrors": write_errors})
+        return _Result(
+            matched_count=counts["nMatched"], upserted_count=counts["nUpserted"]
+        )
+
+    async def count_documents(self, query):
+        return sum(_matches(d, query) for d in self.docs)
+
+    async def update_one(self, query, update, upsert=False):
+        for doc in self.docs:
+            if _matches(doc, query):
+                self._apply(doc, update)
+                return _Result(matched_count=1, upserted_id=None)
+        if upsert:
+            doc = {k: v for k, v in query.items() if not isinstance(v, dict)}
+            doc["_id"] = doc.get("_id", ObjectId())
+            if any(d["_id"] == doc["_id"] for d in self.docs):
+                raise DuplicateKeyError("E11000 duplicate key error", 11000)
+            self._apply(doc, update)
+            self.docs.append(doc)
+            return _Result(matched_count=0, upserted_id=doc["_id"])
+        return _Result(matched_count=0, upserted_id=None)
+
+    async def update_many(self, query, update):
+        matched = [doc for doc in self.docs if _matches(doc, query)]
+        for doc in matched:
+            if isinstance(update, list):
+                for stage in update:
+                    for key, value in stage.get("$set", {}).items():
+                        doc[key] = _evaluate(doc, value)
+            else:
+                self._apply(doc, update)
+        return _Result(matched_count=len(matched), modified_count=len(matched))
+
+    @staticmethod
+    def _apply(doc, update):
+        for key, value in update.get("$set", {}).items():
+            doc[key] = copy.deepcopy(value)
+        for key, value in update.get("$setOnInsert", {}).items():
+            doc.setdefault(key, copy.deepcopy(value))
+        for key, value in update.get("$inc", {}).items():
+            doc[key] = doc.get(key, 0) + value
+
+
+class FakeDatabase(dict):
+    def __missing__(self, name):
+        self[name] = FakeCollection()
+        return self[name]
+
+
+def _reply(contents) -> types.GenerateContentResponse:
+    items = contents if isinstance(contents, list) else [contents]
+    prompt = " ".join(item for item in items if isinstance(item, str))
+    if "stor" in prompt.lower():
+        text = "---STORY---".join(f"\nStory {i}\n" for i in range(3))
+    else:
+        text = "\n".join(f"Handmade Title {i}" for i in range(4))
+    return types.GenerateContentResponse(
+        candidates=[
+            types.Candidate(
+                content=types.Content(parts=[types.Part(text=text)], role="model")
+            )
+        ],
+        usage_metadata=types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=200, candidates_token_count=80, total_token_count=280
+        ),
+    )
+
+
+class _FakeModels:
+    async def generate_content(self, model, contents, config=None):
+        await asyncio.sleep(GEMINI_LATENCY)
+        return _reply(contents)
+
+
+class FakeGenAIClient:
+    """Answers every generate_content call with canned text after a fixed delay"""
+
+    def __init__(self):
+        self.aio = type("Aio", (), {"models": _FakeModels()})()
+
+
+def install() -> FakeDatabase:
+    """Point database.db at an in-memory database; call before importing server"""
+    import database
+
+    database.db = FakeDatabase()
+    return database.db
+
+
+def create_app():
+    """uvicorn factory: the real app, backed by the fakes"""
+    install()
+    os.environ.setdefault("GEMINI_API_KEY", "fake")
+    import model_recorder
+    import server
+
+    # With GEMINI_MODE=replay the recorded responses answer instead of the fake
+    if model_recorder.GEMINI_MODE != "replay":
+        server.router.client = model_recorder.wrap(FakeGenAIClient())
+    return server.app
@@ -0,0 +1,355 @@
+import codecs
+import csv
+import io
+import os
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import orjson
+from bson import ObjectId
+from bson.errors import InvalidId
+from pydantic import ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+import image_store
+import product_events
+from database import db
+from modelsDB import Product
+from responses import dumps
+
+EXPORT_BATCH_SIZE = int(os.getenv("CATALOGUE_EXPORT_BATCH_SIZE", 500))
+IMPORT_BATCH_SIZE = int(os.getenv("CATALOGUE_IMPORT_BATCH_SIZE", 500))
+# Row errors listed in an import report; further errors are only counted
+MAX_REPORTED_ERRORS = 1000
+DUPLICATE_KEY = 11000
+
+# CSV columns; list fields are written as JSON arrays
+CSV_FIELDS = (
+    "_id",
+    "name",
+    "category",
+    "location",
+    "description",
+    "title",
+    "story",
+    "caption",
+    "hashtags",
+    "seo_tags",
+    "image_id",
+    "created_at",
+    "updated_at",
+    "version",
+)
+LIST_FIELDS = ("hashtags", "seo_tags", "images")
+
+
+async def _batches(
+    include_images: bool, size: Optional[int], batch_size: int
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Products in cursor-sized batches, so memory does not grow with the catalogue"""
+    projection = None if include_images else {"image_base64": 0}
+    cursor = db["product"].find({}, projection).sort("_id", 1).batch_size(batch_size)
+    batch = []
+    async for product in cursor:
+        batch.append(product)
+        if len(batch) >= batch_size:
+            yield await _with_images(batch, include_images, size)
+            batch = []
+    if batch:
+        yield await _with_images(batch, include_images, size)
+
+
+async def _with_images(
+    batch: List[Dict[str, Any]], include_images: bool, size: Optional[int]
+) -> List[Dict[str, Any]]:
+    if include_images:
+        images = await image_store.load_images_base64(
+            (p.get("image_id") for p in batch), size
+        )
+        for product in batch:
+            if product.get("image_id") in images:
+                product["image_base64"] = images[product["image_id"]]
+    return batch
+
+
+async def export_ndjson(
+    include_images: bool = False,
+    size: Optional[int] = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+) -> AsyncIterator[bytes]:
+    """One JSON product per line, one chunk per cursor batch"""
+    async for batch in _batches(include_images, size, batch_size):
+        yield b"".join(dumps(product) + b"\n" for product in batch)
+
+
+def _csv_value(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return orjson.dumps(value).decode("utf-8")
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+async def export_csv(batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[bytes]:
+    """CSV with a header row of CSV_FIELDS, one chunk per cursor batch"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_FIELDS)
+    async for batch in _batches(False, None, batch_size):
+        for product in batch:
+            writer.writerow([_csv_value(product.get(f)) for f in CSV_FIELDS])
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+async def _lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Split a byte stream into text lines (line endings kept) as it arrives"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        # Only split on \n: JSON strings may contain other line separators
+        lines = (pending + decoder.decode(chunk)).split("\n")
+        # The last piece may be a partial line; wait for the rest
+        pending = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+async def _ndjson_rows(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    async for line in _lines(chunks):
+        if not line.strip():
+            continue
+        try:
+            yield orjson.loads(line)
+        except orjson.JSONDecodeError as e:
+            yield ValueError(f"Invalid JSON: {e}")
+
+
+async def _csv_rows(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    header = None
+    record = ""
+    async for line in _lines(chunks):
+        # A quoted field may span lines; a record is complete once quotes balance
+        record += line
+        if record.count('"') % 2:
+            continue
+        values = next(csv.reader([record]), [])
+        record = ""
+        if not any(v.strip() for v in values):
+            continue
+        if header is None:
+            header = [v.strip() for v in values]
+            continue
+        if len(values) != len(header):
+            yield ValueError(f"Expected {len(header)} columns, got {len(values)}")
+            continue
+        yield dict(zip(header, values))
+    if record.strip():
+        yield ValueError("Unterminated quoted field")
+
+
+def _from_csv(row: Dict[str, str]) -> Dict[str, Any]:
+    """Undo the CSV encoding: JSON (or comma-separated) lists, empty means unset"""
+    parsed = {}
+    for field, value in row.items():
+        if value == "":
+            continue
+        if field in LIST_FIELDS:
+            if value.lstrip().startswith("["):
+                value = orjson.loads(value)
+            else:
+                value = [v.strip() for v in value.split(",") if v.strip()]
+        parsed[field] = value
+    return parsed
+
+
+# Values of the optional Product fields, for rows that upsert a new product
+_DEFAULTS = {
+    name: field.get_default(call_default_factory=True)
+    for name, field in Product.model_fields.items()
+    if not field.is_required() and name not in ("created_at", "updated_at", "version")
+}
+
+
+def validate_row(row: Any) -> Tuple[Optional[ObjectId], Optional[int], Dict[str, Any]]:
+    """
+    Check one imported row against modelsDB.Product and return (_id or None,
+    expected version or None, document). Raises ValueError with a readable
+    message for invalid rows.
+    """
+    if not isinstance(row, dict):
+        raise ValueError("Row must be a JSON object")
+    product_id = None
+    if row.get("_id"):
+        try:
+            product_id = ObjectId(str(row["_id"]))
+        except InvalidId:
+            raise ValueError(f"Invalid _id: {row['_id']}")
+    try:
+        product = Product.model_validate(row)
+    except ValidationError as e:
+        raise ValueError(
+            "; ".join(
+                f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}"
+                for err in e.errors()
+            )
+        )
+    # Rows with an _id update only the fields they carry; defaults are for inserts
+    document = product.model_dump(
+        exclude={"created_at", "updated_at", "version"},
+        exclude_unset=product_id is not None,
+    )
+    # Images live in the image store; rows refer to them by ID
+    if isinstance(row.get("image_id"), str):
+        document["image_id"] = row["image_id"]
+    # Rows from an export carry the version they were read at
+    version = product.version if "version" in product.model_fields_set else None
+    return product_id, version, document
+
+
+def _update_filter(product_id: ObjectId, version: Optional[int]) -> Dict[str, Any]:
+    if version is None:
+        return {"_id": product_id}
+    # Products written before versioning count as version 0
+    return {
+        "_id": product_id,
+        "version": {"$in": [0, None]} if version == 0 else version,
+    }
+
+
+async def _write(
+    batch: List[Tuple[int, Tuple[Optional[ObjectId], Optional[int], Dict[str, Any]]]],
+) -> Tuple[Dict[str, int], List[Dict[str, Any]]]:
+    """
+    Insert new products and upsert rows that carry an _id, in one round trip
+    each. Rows with a version only apply if the product is still at that
+    version; the others come back as 409 row errors.
+    """
+    now = datetime.utcnow()
+    inserts = [
+        {**doc, "created_at": now, "updated_at": now, "version": 1}
+        for _, (product_id, _, doc) in batch
+        if product_id is None
+    ]
+    versioned = [(row, key) for row, key in batch if key[0] is not None]
+    updates = [
+        UpdateOne(
+            _update_filter(product_id, version),
+            {
+                "$set": {**doc, "updated_at": now},
+                "$setOnInsert": {
+                    **{k: v for k, v in _DEFAULTS.items() if k not in doc},
+                    "created_at": now,
+                },
+                "$inc": {"version": 1},
+            },
+            upsert=True,
+        )
+        for _, (product_id, version, doc) in versioned
+    ]
+    written = {"inserted": 0, "updated": 0}
+    errors = []
+    if inserts:
+        result = await db["product"].insert_many(inserts, ordered=False)
+        written["inserted"] += len(result.inserted_ids)
+    if updates:
+        try:
+            result = await db["product"].bulk_write(updates, ordered=False)
+            written["inserted"] += result.upserted_count
+            written["updated"] += result.matched_count
+        except BulkWriteError as e:
+            # A stale version misses the filter, and the upsert then collides
+            # with the existing _id
+            written["inserted"] += e.details.get("nUpserted", 0)
+            written["updated"] += e.details.get("nMatched", 0)
+            errors = await _row_errors(versioned, e.details.get("writeErrors", []))
+    return written, errors
+
+
+async def _row_errors(
+    versioned: List[Tuple[int, Tuple[ObjectId, Optional[int], Dict[str, Any]]]],
+    write_errors: List[Dict[str, Any]],
+) -> List[Dict[str, Any]]:
+    conflicts = {
+        versioned[e["index"]][1][0]
+        for e in write_errors
+        if e.get("code") == DUPLICATE_KEY
+    }
+    current = {
+        p["_id"]: p.get("version", 0)
+        async for p in db["product"].find(
+            {"_id": {"$in": list(conflicts)}}, {"version": 1}
+        )
+    }
+    errors = []
+    for e in write_errors:
+        row, (product_id, _, _) = versioned[e["index"]]
+        if e.get("code") == DUPLICATE_KEY:
+            errors.append(
+                {
+                    "row": row,
+                    "status": 409,
+                    "error": "Product was changed since this row was exported",
+                    "version": current.get(product_id, 0),
+                }
+            )
+        else:
+            errors.append({"row": row, "error": e.get("errmsg", "Write failed")})
+    return errors
+
+
+async def import_products(
+    chunks: AsyncIterator[bytes], fmt: str, batch_size: int = IMPORT_BATCH_SIZE
+) -> Dict[str, Any]:
+    """
+    Validate and write products from a streamed NDJSON or CSV body. Valid rows
+    are written in batches as they arrive; invalid rows are reported by number
+    (1-based, not counting the CSV header) and skipped. Rows carrying a
+    version that is no longer current are reported with status 409.
+    """
+    rows = _csv_rows(chunks) if fmt == "csv" else _ndjson_rows(chunks)
+    report = {"rows": 0, "inserted": 0, "updated": 0, "failed": 0, "errors": []}
+
+    def fail(error: Dict[str, Any]):
+        report["failed"] += 1
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append(error)
+
+    async def write(batch):
+        written, errors = await _write(batch)
+        for key, count in written.items():
+            report[key] += count
+        for error in errors:
+            fail(error)
+
+    batch = []
+    async for row in rows:
+        report["rows"] += 1
+        try:
+            if isinstance(row, Exception):
+                raise row
+            batch.append(
+                (report["rows"], validate_row(_from_csv(row) if fmt == "csv" else row))
+            )
+        except ValueError as e:
+            fail({"row": report["rows"], "error": str(e)})
+            continue
+        if len(batch) >= batch_size:
+            await write(batch)
+            batch = []
+    if batch:
+        await write(batch)
+    # One event for the whole import; subscribers refetch what they show
+    product_events.publish(
+        "import", None, {"inserted": report["inserted"], "updated": report["updated"]}
+    )
+    return report
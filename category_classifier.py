@@ -0,0 +1,231 @@
+import asyncio
+import heapq
+import math
+import os
+import time
+from collections import defaultdict
+from io import BytesIO
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from PIL import Image, ImageFilter
+
+import image_store
+import metrics
+import workers
+from database import db
+
+# The categories allowed by modelsDB.Product.category
+CATEGORIES = (
+    "textile",
+    "pottery",
+    "furniture",
+    "jewellery",
+    "decorative work",
+    "home utilities",
+)
+
+ENABLED = os.getenv("LOCAL_CATEGORY_CLASSIFIER", "false").lower() == "true"
+# Share of the neighbour vote the winning category needs to skip the LLM
+CONFIDENCE = float(os.getenv("CATEGORY_CLASSIFIER_CONFIDENCE", 0.8))
+# Below this many labeled examples every request goes to the LLM
+MIN_EXAMPLES = int(os.getenv("CATEGORY_CLASSIFIER_MIN_EXAMPLES", 30))
+K_NEIGHBOURS = int(os.getenv("CATEGORY_CLASSIFIER_K", 7))
+# Most recent labeled examples kept for prediction (each one is compared per request)
+MAX_EXAMPLES = int(os.getenv("CATEGORY_CLASSIFIER_MAX_EXAMPLES", 5000))
+REFRESH_SECONDS = 600
+
+HUE_BINS, SAT_BINS, VAL_BINS, EDGE_BINS = 12, 4, 4, 8
+
+
+def _bin(histogram: List[int], bins: int) -> List[float]:
+    """Collapse a 256-entry channel histogram into `bins` normalised bins"""
+    width = 256 // bins
+    counts = [sum(histogram[i * width : (i + 1) * width]) for i in range(bins)]
+    total = sum(counts) or 1
+    return [c / total for c in counts]
+
+
+def extract_features(image_data: bytes) -> List[float]:
+    """
+    Colour and texture descriptor: HSV histograms plus a histogram of edge
+    strength, each normalised so image size does not matter.
+    """
+    image = Image.open(BytesIO(image_data)).convert("RGB")
+    image.thumbnail((96, 96))
+    hsv = image.convert("HSV").histogram()
+    edges = image.convert("L").filter(ImageFilter.FIND_EDGES).histogram()
+    return (
+        _bin(hsv[0:256], HUE_BINS)
+        + _bin(hsv[256:512], SAT_BINS)
+        + _bin(hsv[512:768], VAL_BINS)
+        + _bin(edges, EDGE_BINS)
+    )
+
+
+def _distance(a: List[float], b: List[float]) -> float:
+    return math.fsum(abs(x - y) for x, y in zip(a, b))
+
+
+class KNNClassifier:
+    """Nearest-neighbour vote over labeled feature vectors"""
+
+    def __init__(self, k: int = K_NEIGHBOURS, max_examples: int = None):
+        self.k = k
+        self.max_examples = max_examples
+        self.examples: Dict[str, Tuple[List[float], str]] = {}
+
+    def add(self, key: str, features: List[float], category: str):
+        self.examples.pop(key, None)
+        self.examples[key] = (features, category)
+        if self.max_examples and len(self.examples) > self.max_examples:
+            # Forget the oldest example
+            del self.examples[next(iter(self.examples))]
+
+    def predict(self, features: List[float]) -> Optional[Tuple[str, float]]:
+        """Return (category, confidence), where confidence is the weighted vote share"""
+        return vote(features, list(self.examples.values()), self.k)
+
+
+def vote(
+    features: List[float], examples: List[Tuple[List[float], str]], k: int
+) -> Optional[Tuple[str, float]]:
+    """Distance-weighted vote of the k nearest examples"""
+    if not examples:
+        return None
+    nearest = heapq.nsmallest(k, ((_distance(features, f), c) for f, c in examples))
+    votes = defaultdict(float)
+    for distance, category in nearest:
+        votes[category] += 1 / (distance + 1e-6)
+    category, weight = max(votes.items(), key=lambda item: item[1])
+    return category, weight / sum(votes.values())
+
+
+def predict_image(
+    image_data: bytes, examples: List[Tuple[List[float], str]], k: int
+) -> Optional[Tuple[str, float]]:
+    """Features and neighbour vote for an image; runs in the CPU pool"""
+    return vote(extract_features(image_data), examples, k)
+
+
+_classifier = KNNClassifier(max_examples=MAX_EXAMPLES)
+_loaded_at: Optional[float] = None
+_building: Optional[asyncio.Task] = None
+# Examples added while a rebuild runs, replayed into the new classifier
+_pending: List[Tuple[str, List[float], str]] = []
+
+
+async def _build():
+    global _classifier, _loaded_at
+    classifier = KNNClassifier(max_examples=MAX_EXAMPLES)
+    cursor = db["category_examples"].find({}).sort("updated_at", -1).limit(MAX_EXAMPLES)
+    examples = await cursor.to_list(length=None)
+    # Oldest first, so the cap evicts the oldest
+    for example in reversed(examples):
+        classifier.add(example["_id"], example["features"], example["category"])
+    for example in _pending:
+        classifier.add(*example)
+    _pending.clear()
+    _classifier, _loaded_at = classifier, time.monotonic()
+
+
+def _ensure_loaded():
+    """Start a background rebuild when the examples are stale; old ones keep serving"""
+    global _building
+    stale = _loaded_at is None or time.monotonic() - _loaded_at >= REFRESH_SECONDS
+    if stale and (_building is None or _building.done()):
+        _building = asyncio.create_task(_build())
+
+
+async def classify(image_data: bytes) -> Optional[Tuple[str, float, bool]]:
+    """
+    Predict the category of an image locally.
+    Returns (category, confidence, confident) or None when disabled or untrained;
+    callers should only skip the LLM when `confident` is True.
+    """
+    if not ENABLED:
+        return None
+    _ensure_loaded()
+    if len(_classifier.examples) < MIN_EXAMPLES:
+        metrics.inc("category_classifier_total", outcome="untrained")
+        return None
+    # A snapshot, since examples may be added while the pool works
+    examples = list(_classifier.examples.values())
+    category, confidence = await workers.run_cpu(
+        predict_image, image_data, examples, _classifier.k
+    )
+    confident = confidence >= CONFIDENCE
+    metrics.inc("category_classifier_total", outcome="hit" if confident else "miss")
+    return category, confidence, confident
+
+
+def record_llm_category(prediction: Optional[Tuple[str, float, bool]], category: str):
+    """Shadow-compare a non-confident local prediction with the LLM's answer"""
+    if prediction is None:
+        return
+    metrics.inc(
+        "category_classifier_agreement_total",
+        agree=prediction[0] == category.strip().lower(),
+    )
+
+
+async def add_example(image_id: str, image_data: bytes, category: str):
+    """Store a labeled example; category must be one of CATEGORIES"""
+    category = category.strip().lower()
+    if category not in CATEGORIES:
+        return
+    features = await workers.run_cpu(extract_features, image_data)
+    await db["category_examples"].update_one(
+        {"_id": image_id},
+        {
+            "$set": {
+                "features": features,
+                "category": category,
+                "updated_at": datetime.utcnow(),
+            }
+        },
+        upsert=True,
+    )
+    if _building is not None and not _building.done():
+        _pending.append((image_id, features, category))
+    _classifier.add(image_id, features, category)
+
+
+async def learn_from_product(product_id: str):
+    """
+    Use a product with both an image and a category as a labeled example.
+    Called after the product write has committed, so failures are only logged.
+    """
+    if not ENABLED:
+        return
+    try:
+        product = await db["product"].find_one(
+            {"_id": ObjectId(product_id)}, {"image_id": 1, "category": 1}
+        )
+        if not product or not product.get("image_id") or not product.get("category"):
+            return
+        record = await image_store.get_image(product["image_id"])
+        await add_example(product["image_id"], record["data"], product["category"])
+    except Exception as e:
+        print(f"Could not learn the category of product {product_id}: {e}")
+
+
+async def rebuild_examples() -> int:
+    """Rebuild the example set from every labeled product in Mongo"""
+    count = 0
+    cursor = db["product"].find(
+        {"image_id": {"$nin": [None, ""]}, "category": {"$in": list(CATEGORIES)}},
+        {"image_id": 1, "category": 1},
+    )
+    async for product in cursor:
+        record = await image_store.get_image(product["image_id"])
+        await add_example(product["image_id"], record["data"], product["category"])
+        count += 1
+    return count
+
+
+if __name__ == "__main__":
+    import asyncio
+
+    print(f"Stored {asyncio.run(rebuild_examples())} labeled examples")
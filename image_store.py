@@ -0,0 +1,529 @@
+import base64
+import binascii
+import hashlib
+import os
+from datetime import datetime
+from io import BytesIO
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import HTTPException, UploadFile
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from PIL import Image, ImageOps
+
+import tracing
+import workers
+from database import db
+
+# Hamming distance (in bits, out of 64) under which two perceptual hashes are
+# treated as the same photo for the purpose of reusing model results.
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", 6))
+
+# Generated images, names and category depend on nothing but the photo, so
+# reusing them needs a closer match: a stricter hash distance, the same aspect
+# ratio and a similar colour layout (two products shot against the same plain
+# background can have near-identical difference hashes).
+STRICT_PHASH_MAX_DISTANCE = int(os.getenv("STRICT_PHASH_MAX_DISTANCE", 2))
+ASPECT_TOLERANCE = 0.02
+# Largest per-channel difference (0-255) between cells of the 4x4 colour grids
+COLOR_MAX_DISTANCE = int(os.getenv("COLOR_MAX_DISTANCE", 24))
+
+# The 64-bit hash is split into 8 one-byte bands. Two hashes within distance
+# 7 must share at least one band, so a band lookup finds every candidate.
+PHASH_BANDS = 8
+
+# Fixed widths (in pixels) derived for every stored image, plus the encoding.
+THUMBNAIL_WIDTHS = tuple(
+    int(w) for w in os.getenv("THUMBNAIL_WIDTHS", "128,256,512").split(",")
+)
+THUMBNAIL_FORMAT = os.getenv("THUMBNAIL_FORMAT", "WEBP").upper()
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", 80))
+ORIENTATION_TAG = 0x0112
+# Larger originals go to GridFS; a Mongo document is limited to 16 MB and the
+# model accepts requests up to 20 MB
+INLINE_BLOB_LIMIT = 15 * 1024 * 1024
+
+
+def sha256_hex(image_data: bytes) -> str:
+    """Return the content hash used as the image ID"""
+    return hashlib.sha256(image_data).hexdigest()
+
+
+def perceptual_hash(image: Image.Image) -> str:
+    """Compute a 64-bit difference hash (dHash) as 16 hex characters"""
+    small = image.convert("L").resize((9, 8), Image.Resampling.LANCZOS)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            bits = (bits << 1) | (1 if left > right else 0)
+    return f"{bits:016x}"
+
+
+def decode_image(image_data: bytes) -> Image.Image:
+    """Decode image bytes into an RGB PIL Image"""
+    image = Image.open(BytesIO(image_data))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return image
+
+
+def color_signature(image: Image.Image) -> str:
+    """Mean colour of each cell of a 4x4 grid, as 96 hex characters"""
+    return image.convert("RGB").resize((4, 4), Image.Resampling.BOX).tobytes().hex()
+
+
+def color_distance(a: str, b: str) -> int:
+    return max(abs(x - y) for x, y in zip(bytes.fromhex(a), bytes.fromhex(b)))
+
+
+def image_fingerprint(image_data: bytes) -> Tuple[str, int, int, str]:
+    """Return (perceptual hash, width, height, colour signature) for image bytes"""
+    image = Image.open(BytesIO(image_data))
+    image.load()
+    return perceptual_hash(image), image.width, image.height, color_signature(image)
+
+
+# Upload formats Gemini accepts as-is; anything else is re-encoded as JPEG
+MODEL_IMAGE_FORMATS = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+    "HEIF": "image/heif",
+}
+
+
+def model_mime_type(image_data: bytes) -> Optional[str]:
+    """MIME type to send the upload to the model unchanged, or None to re-encode"""
+    try:
+        # Only parses the header, so it is cheap enough for the event loop
+        return MODEL_IMAGE_FORMATS.get(Image.open(BytesIO(image_data)).format)
+    except Exception:
+        return None
+
+
+def encode_for_model(image_data: bytes) -> bytes:
+    """Re-encode an upload in a format the model does not accept as JPEG"""
+    buffer = BytesIO()
+    decode_image(image_data).save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def encode_data_uris(images: List[Tuple[bytes, str]]) -> List[str]:
+    """Base64-encode (bytes, mime type) pairs as data URIs"""
+    return [
+        f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
+        for data, mime_type in images
+    ]
+
+
+def phash_bands(phash: str) -> List[str]:
+    """Split a perceptual hash into indexable bands"""
+    return [f"{i}:{phash[i * 2:i * 2 + 2]}" for i in range(PHASH_BANDS)]
+
+
+def hamming_distance(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+def make_thumbnails(
+    image_data: bytes, widths: Tuple[int, ...], image_format: str, quality: int
+) -> Dict[int, bytes]:
+    """
+    Encode downscaled copies of an image, one per width narrower than the original.
+    Runs in a worker process, so it only takes and returns plain bytes.
+    """
+    # Phone photos are stored sideways with an EXIF orientation; apply it
+    image = ImageOps.exif_transpose(Image.open(BytesIO(image_data)))
+    if image.mode not in ("RGB", "RGBA") or image_format == "JPEG":
+        image = image.convert("RGB")
+    thumbnails = {}
+    for width in sorted(widths):
+        if width >= image.width:
+            break
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), Image.Resampling.LANCZOS)
+        buffer = BytesIO()
+        resized.save(buffer, format=image_format, quality=quality)
+        thumbnails[width] = buffer.getvalue()
+    return thumbnails
+
+
+def exif_orientation(image_data: bytes) -> int:
+    """EXIF orientation tag of an image (1, upright, when absent)"""
+    return Image.open(BytesIO(image_data)).getexif().get(ORIENTATION_TAG, 1)
+
+
+async def store_thumbnails(image_id: str, image_data: bytes, replace: bool = False):
+    """
+    Derive and persist the fixed-width variants of a stored image. Existing
+    thumbnails are kept unless replace is True.
+    """
+    thumbnails = await workers.run_cpu(
+        make_thumbnails,
+        image_data,
+        THUMBNAIL_WIDTHS,
+        THUMBNAIL_FORMAT,
+        THUMBNAIL_QUALITY,
+    )
+    mime_type = f"image/{THUMBNAIL_FORMAT.lower()}"
+    for width, data in thumbnails.items():
+        await db["image_thumbnails"].update_one(
+            {"_id": f"{image_id}:{width}"},
+            {
+                "$set" if replace else "$setOnInsert": {
+                    "image_id": image_id,
+                    "width": width,
+                    "mime_type": mime_type,
+                    "data": data,
+                }
+            },
+            upsert=True,
+        )
+
+
+async def store_image(image_data: bytes, mime_type: str) -> Dict[str, Any]:
+    """
+    Store an image once, keyed by its SHA-256.
+    Returns the image record (without the raw bytes).
+    """
+    image_id = sha256_hex(image_data)
+    existing = await db["image_blobs"].find_one({"_id": image_id}, {"data": 0})
+    if existing:
+        await _ensure_colors(existing, image_data)
+        existing["image_id"] = existing.pop("_id")
+        existing["deduplicated"] = True
+        return existing
+
+    try:
+        phash, width, height, colors = await workers.run_cpu(
+            image_fingerprint, image_data
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error processing image: {str(e)}")
+
+    record = {
+        "_id": image_id,
+        "phash": phash,
+        "phash_bands": phash_bands(phash),
+        "mime_type": mime_type,
+        "width": width,
+        "height": height,
+        "colors": colors,
+        "size": len(image_data),
+        "created_at": datetime.utcnow(),
+    }
+    if len(image_data) <= INLINE_BLOB_LIMIT:
+        blob = {"data": image_data}
+    else:
+        blob = {"file_id": await _files().upload_from_stream(image_id, image_data)}
+    # Upsert so two concurrent uploads of the same image cannot both insert.
+    result = await db["image_blobs"].update_one(
+        {"_id": image_id},
+        {"$setOnInsert": {**record, **blob}},
+        upsert=True,
+    )
+    if "file_id" in blob and result.upserted_id is None:
+        # Another upload of the same image won; its file is the one referenced
+        await _files().delete(blob["file_id"])
+    await store_thumbnails(image_id, image_data)
+    record["image_id"] = record.pop("_id")
+    record["deduplicated"] = False
+    return record
+
+
+async def _ensure_colors(record: Dict[str, Any], image_data: bytes):
+    """Add the colour signature to an image stored before it was computed"""
+    if record.get("colors"):
+        return
+    record["colors"] = (await workers.run_cpu(image_fingerprint, image_data))[3]
+    await db["image_blobs"].update_one(
+        {"_id": record["_id"]}, {"$set": {"colors": record["colors"]}}
+    )
+
+
+async def store_image_base64(image_base64: str) -> Dict[str, Any]:
+    """Store an image given as plain base64 or a data URI"""
+    mime_type = "application/octet-stream"
+    if image_base64.startswith("data:"):
+        header, _, image_base64 = image_base64.partition(",")
+        mime_type = header[len("data:") :].split(";")[0] or mime_type
+    try:
+        image_data = base64.b64decode(image_base64, validate=True)
+    except binascii.Error:
+        raise HTTPException(status_code=400, detail="Invalid base64 string")
+    if mime_type == "application/octet-stream":
+        mime_type = guess_mime_type(image_data)
+    return await store_image(image_data, mime_type)
+
+
+def guess_mime_type(image_data: bytes) -> str:
+    try:
+        image_format = Image.open(BytesIO(image_data)).format
+    except Exception:
+        raise HTTPException(status_code=400, detail="Data is not a valid image")
+    return Image.MIME.get(image_format, "application/octet-stream")
+
+
+_bucket: Optional[AsyncIOMotorGridFSBucket] = None
+
+
+def _files() -> AsyncIOMotorGridFSBucket:
+    global _bucket
+    if _bucket is None:
+        _bucket = AsyncIOMotorGridFSBucket(db, bucket_name="image_files")
+    return _bucket
+
+
+async def _blob_data(record: Dict[str, Any]) -> bytes:
+    """The bytes of an image_blobs record, inline or in GridFS"""
+    if "data" not in record:
+        stream = await _files().open_download_stream(record["file_id"])
+        record["data"] = await stream.read()
+    return record["data"]
+
+
+async def get_image(image_id: str, with_data: bool = True) -> Dict[str, Any]:
+    """Fetch an image record, including its bytes unless with_data is False"""
+    projection = None if with_data else {"data": 0}
+    record = await db["image_blobs"].find_one({"_id": image_id}, projection)
+    if not record:
+        raise HTTPException(status_code=404, detail="Image not found")
+    if with_data:
+        await _blob_data(record)
+    return record
+
+
+async def load_images(image_ids: List[str]) -> List[Tuple[bytes, str]]:
+    """Load (bytes, mime type) for several images, in the given order"""
+    found = {}
+    async for record in db["image_blobs"].find({"_id": {"$in": list(image_ids)}}):
+        found[record["_id"]] = (await _blob_data(record), record["mime_type"])
+    missing = [i for i in image_ids if i not in found]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Images not found: {missing}")
+    return [found[i] for i in image_ids]
+
+
+def variant_width(size: Optional[int]) -> Optional[int]:
+    """Smallest stored thumbnail width that covers the requested size"""
+    if not size:
+        return None
+    for width in sorted(THUMBNAIL_WIDTHS):
+        if width >= size:
+            return width
+    return None
+
+
+async def get_image_variant(image_id: str, size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Fetch an image at the requested width, falling back to the original
+    when no thumbnail that large exists (e.g. the original is smaller).
+    """
+    width = variant_width(size)
+    if width:
+        thumbnail = await db["image_thumbnails"].find_one({"_id": f"{image_id}:{width}"})
+        if thumbnail:
+            return thumbnail
+    return await get_image(image_id)
+
+
+async def load_images_base64(
+    image_ids: Iterable[str], size: Optional[int] = None
+) -> Dict[str, str]:
+    """Batch-load images as data URIs, keyed by image ID"""
+    ids = list({i for i in image_ids if i})
+    if not ids:
+        return {}
+    raw = {}
+    width = variant_width(size)
+    if width:
+        cursor = db["image_thumbnails"].find({"image_id": {"$in": ids}, "width": width})
+        async for record in cursor:
+            raw[record["image_id"]] = (record["data"], record["mime_type"])
+        ids = [i for i in ids if i not in raw]
+    if ids:
+        async for record in db["image_blobs"].find({"_id": {"$in": ids}}):
+            raw[record["_id"]] = (await _blob_data(record), record["mime_type"])
+    if not raw:
+        return {}
+    encoded = await workers.run_cpu(encode_data_uris, list(raw.values()))
+    return dict(zip(raw.keys(), encoded))
+
+
+async def resolve_upload(
+    image: Optional[UploadFile], image_id: Optional[str]
+) -> Tuple[bytes, Dict[str, Any]]:
+    """
+    Return (image bytes, image record) for an endpoint that accepts either
+    a fresh upload or the ID of a previously stored image.
+    """
+    if image is not None:
+        if not image.content_type or not image.content_type.startswith("image/"):
+            raise HTTPException(status_code=400, detail="File must be an image")
+        with tracing.span("upload.read") as span:
+            image_data = await image.read()
+            record = await store_image(image_data, image.content_type)
+            span.set_attributes(
+                {
+                    "image.bytes": len(image_data),
+                    "image.mime_type": image.content_type,
+                    "image.deduplicated": record["deduplicated"],
+                }
+            )
+        return image_data, record
+    if image_id:
+        with tracing.span("image_store.get", {"image.id": image_id}):
+            record = await get_image(image_id)
+        image_data = record.pop("data")
+        await _ensure_colors(record, image_data)
+        record["image_id"] = record.pop("_id")
+        record["deduplicated"] = True
+        return image_data, record
+    raise HTTPException(status_code=400, detail="Either image or image_id is required")
+
+
+def params_key(*params: str) -> str:
+    """Stable key for the non-image inputs of a cached model call"""
+    return hashlib.sha256("\x1f".join(params).encode("utf-8")).hexdigest()
+
+
+def _same_shape(image: Dict[str, Any], candidate: Dict[str, Any]) -> bool:
+    if not candidate.get("colors") or not candidate.get("aspect"):
+        return False
+    aspect = image["width"] / image["height"]
+    return (
+        abs(aspect - candidate["aspect"]) <= ASPECT_TOLERANCE * aspect
+        and color_distance(image["colors"], candidate["colors"]) <= COLOR_MAX_DISTANCE
+    )
+
+
+async def find_cached_result(
+    phash: str, task: str, params: str = "", image: Dict[str, Any] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Look up a stored model result for the same or a near-duplicate image.
+    Returns the closest match within PHASH_MAX_DISTANCE, if any. Given the
+    image record, the match must also be within STRICT_PHASH_MAX_DISTANCE and
+    have the same aspect ratio and a similar colour layout.
+    """
+    max_distance = PHASH_MAX_DISTANCE if image is None else STRICT_PHASH_MAX_DISTANCE
+    best, best_distance = None, max_distance + 1
+    with tracing.span("cache.lookup", {"cache.name": "image_results"}) as span:
+        cursor = db["image_results"].find(
+            {"task": task, "params": params, "phash_bands": {"$in": phash_bands(phash)}}
+        )
+        async for candidate in cursor:
+            distance = hamming_distance(phash, candidate["phash"])
+            if distance >= best_distance:
+                continue
+            if image is not None and not _same_shape(image, candidate):
+                continue
+            best, best_distance = candidate, distance
+        span.set_attribute("cache.hit", best is not None)
+    if best is None:
+        return None
+    return best["result"]
+
+
+async def cache_result(
+    image_id: str,
+    phash: str,
+    task: str,
+    result: Dict[str, Any],
+    params: str = "",
+    image: Dict[str, Any] = None,
+):
+    """
+    Remember a model result so near-duplicate uploads can reuse it. Pass the
+    image record to allow the stricter lookup.
+    """
+    fields = {
+        "phash": phash,
+        "phash_bands": phash_bands(phash),
+        "result": result,
+        "created_at": datetime.utcnow(),
+    }
+    if image is not None:
+        fields["aspect"] = image["width"] / image["height"]
+        fields["colors"] = image["colors"]
+    await db["image_results"].update_one(
+        {"image_id": image_id, "task": task, "params": params},
+        {"$set": fields},
+        upsert=True,
+    )
+
+
+async def ensure_indexes():
+    await db["image_blobs"].create_index("phash_bands")
+    await db["image_results"].create_index(
+        [("task", 1), ("params", 1), ("phash_bands", 1)]
+    )
+    await db["image_results"].create_index(
+        [("image_id", 1), ("task", 1), ("params", 1)], unique=True
+    )
+    await db["image_thumbnails"].create_index([("image_id", 1), ("width", 1)])
+
+
+async def rebuild_rotated_thumbnails() -> int:
+    """
+    Re-derive the thumbnails of images with an EXIF orientation; those made
+    before the orientation was applied are sideways or upside down
+    """
+    count = 0
+    async for record in db["image_blobs"].find({}, {"data": 1, "file_id": 1}):
+        image_data = await _blob_data(record)
+        if exif_orientation(image_data) != 1:
+            await store_thumbnails(record["_id"], image_data, replace=True)
+            count += 1
+    return count
+
+
+async def migrate_inline_images() -> int:
+    """
+    Move images stored inline on products (before the image store) into it,
+    so they get an image_id and thumbnails. Returns the products migrated.
+    """
+    count = 0
+    cursor = db["product"].find(
+        {"image_base64": {"$nin": ["", None]}, "image_id": {"$in": ["", None]}},
+        {"image_base64": 1},
+    )
+    async for product in cursor:
+        try:
+            record = await store_image_base64(product["image_base64"])
+        except HTTPException as e:
+            print(f"Product {product['_id']} has an unreadable image: {e.detail}")
+            continue
+        # Only if the image was not replaced meanwhile; the content is unchanged,
+        # so the version is too
+        await db["product"].update_one(
+            {"_id": product["_id"], "image_base64": product["image_base64"]},
+            {"$set": {"image_id": record["image_id"], "image_base64": ""}},
+        )
+        count += 1
+    return count
+
+
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+
+    parser = argparse.ArgumentParser(description="Image store maintenance")
+    parser.add_argument(
+        "command",
+        nargs="?",
+        choices=("rotate", "migrate"),
+        default="rotate",
+        help="rotate: rebuild the thumbnails of EXIF-rotated images; "
+        "migrate: move images stored inline on products into the store",
+    )
+    if parser.parse_args().command == "migrate":
+        print(f"Migrated the images of {asyncio.run(migrate_inline_images())} products")
+    else:
+        print(
+            f"Rebuilt thumbnails of {asyncio.run(rebuild_rotated_thumbnails())} images"
+        )
@@ -0,0 +1,66 @@
+from collections import defaultdict
+from typing import Dict, Tuple
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+_counters: Dict[str, Dict[LabelKey, float]] = defaultdict(lambda: defaultdict(float))
+_histograms: Dict[str, Dict[LabelKey, Dict[str, object]]] = defaultdict(dict)
+
+
+def _key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, amount: float = 1, **labels: object):
+    """Add to a counter"""
+    _counters[name][_key(labels)] += amount
+
+
+def observe(name: str, value: float, buckets=LATENCY_BUCKETS, **labels: object):
+    """Record a value in a histogram"""
+    series = _histograms[name].setdefault(
+        _key(labels),
+        {"count": 0, "sum": 0.0, "buckets": dict.fromkeys(buckets, 0)},
+    )
+    series["count"] += 1
+    series["sum"] += value
+    for bound in series["buckets"]:
+        if value <= bound:
+            series["buckets"][bound] += 1
+
+
+def counter_value(name: str, **labels: object) -> float:
+    return _counters[name].get(_key(labels), 0)
+
+
+def _format_labels(key: LabelKey, **extra: object) -> str:
+    pairs = list(key) + [(k, str(v)) for k, v in extra.items()]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+def render_prometheus() -> str:
+    """Render all metrics in the Prometheus text exposition format"""
+    lines = []
+    for name, series in _counters.items():
+        lines.append(f"# TYPE {name} counter")
+        for key, value in series.items():
+            lines.append(f"{name}{_format_labels(key)} {value}")
+    for name, series in _histograms.items():
+        lines.append(f"# TYPE {name} histogram")
+        for key, data in series.items():
+            for bound, count in data["buckets"].items():
+                lines.append(f"{name}_bucket{_format_labels(key, le=bound)} {count}")
+            lines.append(f'{name}_bucket{_format_labels(key, le="+Inf")} {data["count"]}')
+            lines.append(f"{name}_sum{_format_labels(key)} {data['sum']}")
+            lines.append(f"{name}_count{_format_labels(key)} {data['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    _counters.clear()
+    _histograms.clear()
@@ -0,0 +1,212 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson
+from google.genai import errors, types
+from PIL import Image
+
+import tracing
+
+# "live" calls Gemini; "record" calls Gemini and saves each request fingerprint,
+# response and latency to GEMINI_RECORDINGS; "replay" answers from that file
+# without network access (no GEMINI_API_KEY needed).
+GEMINI_MODE = os.getenv("GEMINI_MODE", "live").lower()
+GEMINI_RECORDINGS = os.getenv("GEMINI_RECORDINGS", "gemini_recordings.sqlite")
+# Replayed latency is the recorded latency times this (0 answers immediately)
+REPLAY_LATENCY_SCALE = float(os.getenv("GEMINI_REPLAY_LATENCY_SCALE", 1.0))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+    id INTEGER PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    model TEXT NOT NULL,
+    latency REAL NOT NULL,
+    response BLOB,
+    error BLOB,
+    recorded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS recordings_fingerprint ON recordings (fingerprint);
+"""
+
+# (latency, zlib-compressed response JSON, zlib-compressed error JSON)
+Recording = Tuple[float, Optional[bytes], Optional[bytes]]
+
+
+class ReplayMiss(LookupError):
+    """No recording matches a replayed request"""
+
+
+def fingerprint(model: str, contents: Any, config: Any = None) -> str:
+    """
+    Hash of everything that determines a generate_content reply. Image parts
+    are hashed by their encoded bytes; PIL images (decoded pixels) cost far
+    more, so callers should send bytes.
+    """
+    digest = hashlib.sha256()
+
+    def add(kind: bytes, data: bytes):
+        digest.update(kind + len(data).to_bytes(8, "big") + data)
+
+    add(b"m", model.encode())
+    for item in contents if isinstance(contents, list) else [contents]:
+        if isinstance(item, str):
+            add(b"t", item.encode("utf-8"))
+        elif isinstance(item, Image.Image):
+            add(b"i", f"{item.mode} {item.width}x{item.height}".encode())
+            add(b"p", item.tobytes())
+        elif isinstance(item, (bytes, bytearray)):
+            add(b"b", bytes(item))
+        elif getattr(item, "inline_data", None) is not None:
+            # The uploaded bytes as sent, without a base64 JSON copy
+            add(b"d", (item.inline_data.mime_type or "").encode())
+            add(b"b", item.inline_data.data or b"")
+        elif hasattr(item, "model_dump_json"):
+            add(b"j", item.model_dump_json(exclude_none=True).encode())
+        else:
+            add(b"r", repr(item).encode())
+    if config is not None:
+        if hasattr(config, "model_dump_json"):
+            add(b"c", config.model_dump_json(exclude_none=True).encode())
+        else:
+            add(b"c", orjson.dumps(config, option=orjson.OPT_SORT_KEYS))
+    return digest.hexdigest()
+
+
+class RecordingStore:
+    """SQLite file of recorded replies, safe to share between worker processes"""
+
+    def __init__(self, path: str = GEMINI_RECORDINGS):
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def add(
+        self,
+        fingerprint: str,
+        model: str,
+        latency: float,
+        response: Optional[types.GenerateContentResponse] = None,
+        error: Optional[Dict[str, Any]] = None,
+    ):
+        try:
+            row = (
+                fingerprint,
+                model,
+                latency,
+                (
+                    zlib.compress(response.model_dump_json(exclude_none=True).encode())
+                    if response is not None
+                    else None
+                ),
+                zlib.compress(orjson.dumps(error)) if error is not None else None,
+                time.time(),
+            )
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT INTO recordings"
+                    " (fingerprint, model, latency, response, error, recorded_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    row,
+                )
+        except Exception as e:
+            print(f"Failed to record Gemini response: {e}")
+
+    def load(self) -> Dict[str, List[Recording]]:
+        recordings = defaultdict(list)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT fingerprint, latency, response, error FROM recordings"
+                " ORDER BY id"
+            ).fetchall()
+        for fp, latency, response, error in rows:
+            recordings[fp].append((latency, response, error))
+        return dict(recordings)
+
+
+class _RecordingModels:
+    def __init__(self, models, store: RecordingStore):
+        self._models = models
+        self._store = store
+
+    def _save(self, *args):
+        # Written from the default executor so callers never wait on the disk
+        asyncio.get_running_loop().run_in_executor(None, self._store.add, *args)
+
+    async def generate_content(self, model: str, contents: Any, config: Any = None):
+        fp = fingerprint(model, contents, config)
+        start = time.monotonic()
+        try:
+            response = await self._models.generate_content(
+                model=model, contents=contents, config=config
+            )
+        except errors.APIError as e:
+            error = {"code": e.code, "details": e.details}
+            self._save(fp, model, time.monotonic() - start, None, error)
+            raise
+        except asyncio.CancelledError:
+            # Usually the router's timeout; replayed as a timeout after this long
+            self._save(fp, model, time.monotonic() - start, None, {"timeout": True})
+            raise
+        self._save(fp, model, time.monotonic() - start, response)
+        return response
+
+
+class _ReplayModels:
+    def __init__(self, store: RecordingStore, latency_scale: float):
+        self._recordings = store.load()
+        self._latency_scale = latency_scale
+        self._replayed: Dict[str, int] = defaultdict(int)
+
+    async def generate_content(self, model: str, contents: Any, config: Any = None):
+        fp = fingerprint(model, contents, config)
+        recordings = self._recordings.get(fp)
+        if not recordings:
+            raise ReplayMiss(
+                f"No recorded {model} response for request {fp[:12]};"
+                " record it with GEMINI_MODE=record"
+            )
+        # Repeated requests cycle through every recorded reply, in recorded order
+        latency, response, error = recordings[self._replayed[fp] % len(recordings)]
+        self._replayed[fp] += 1
+        tracing.current_span().set_attribute("app.replayed", True)
+        await asyncio.sleep(latency * self._latency_scale)
+        if error is not None:
+            error = orjson.loads(zlib.decompress(error))
+            if error.get("timeout"):
+                raise asyncio.TimeoutError("Replayed timeout")
+            if error["code"] >= 500:
+                raise errors.ServerError(error["code"], error["details"])
+            raise errors.ClientError(error["code"], error["details"])
+        return types.GenerateContentResponse.model_validate_json(
+            zlib.decompress(response)
+        )
+
+
+class _Client:
+    """The part of genai.Client the ModelRouter uses: client.aio.models"""
+
+    def __init__(self, models):
+        self.aio = type("Aio", (), {"models": models})()
+
+
+def wrap(client, mode: str = GEMINI_MODE, store: RecordingStore = None):
+    """
+    Wrap a genai.Client for the given mode. In replay mode client may be None;
+    in live mode it is returned unchanged.
+    """
+    if mode == "live":
+        return client
+    store = store or RecordingStore()
+    if mode == "record":
+        return _Client(_RecordingModels(client.aio.models, store))
+    if mode == "replay":
+        return _Client(_ReplayModels(store, REPLAY_LATENCY_SCALE))
+    raise ValueError(f"GEMINI_MODE must be live, record or replay, not {mode!r}")
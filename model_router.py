@@ -0,0 +1,328 @@
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from google.genai import errors
+from PIL import Image
+
+import metrics
+import tracing
+
+# Define model names
+TEXT_MODEL = "gemini-2.5-flash"
+LITE_MODEL = "gemini-2.5-flash-lite"
+IMAGE_GENERATION_MODEL = "gemini-2.5-flash-image"
+
+# Gemini rejects requests with more than this much inline data
+INLINE_REQUEST_LIMIT = 20 * 1024 * 1024
+
+# Per task, candidate models in order of preference and a latency budget
+# (seconds across all attempts) used when the caller does not pass one. A
+# candidate is skipped when the input is larger than its max_input_bytes, when
+# it is cooling down after a rate limit or repeated timeouts, or when its
+# typical latency does not fit the budget. Override with MODEL_ROUTES (JSON)
+# or MODEL_ROUTES_FILE (path to JSON); a task may also be given as just its
+# list of candidates.
+DEFAULT_ROUTES: Dict[str, Dict[str, Any]] = {
+    "image-generation": {
+        "latency_budget": 120,
+        "candidates": [
+            {
+                "model": IMAGE_GENERATION_MODEL,
+                "timeout": 90,
+                "max_input_bytes": INLINE_REQUEST_LIMIT,
+            }
+        ],
+    },
+    # Six-way classification and short names do not need the larger model
+    "category": {
+        "latency_budget": 25,
+        "candidates": [
+            {"model": LITE_MODEL, "timeout": 10, "max_input_bytes": 4 * 1024 * 1024},
+            {"model": TEXT_MODEL, "timeout": 20},
+        ],
+    },
+    "product-names": {
+        "latency_budget": 25,
+        "candidates": [
+            {"model": LITE_MODEL, "timeout": 10, "max_input_bytes": 4 * 1024 * 1024},
+            {"model": TEXT_MODEL, "timeout": 20},
+        ],
+    },
+    "titles": {
+        "latency_budget": 30,
+        "candidates": [
+            {"model": TEXT_MODEL, "timeout": 20},
+            {"model": LITE_MODEL, "timeout": 10},
+        ],
+    },
+    "stories": {
+        "latency_budget": 60,
+        "candidates": [
+            {"model": TEXT_MODEL, "timeout": 45},
+            {"model": LITE_MODEL, "timeout": 30},
+        ],
+    },
+    "tags-captions": {
+        "latency_budget": 45,
+        "candidates": [
+            {
+                "model": TEXT_MODEL,
+                "timeout": 30,
+                "max_input_bytes": INLINE_REQUEST_LIMIT,
+            },
+            {"model": LITE_MODEL, "timeout": 20, "max_input_bytes": 4 * 1024 * 1024},
+        ],
+    },
+}
+
+# Seconds a model is skipped after it answered with a rate limit
+RATE_LIMIT_COOLDOWN = float(os.getenv("MODEL_RATE_LIMIT_COOLDOWN", 30))
+# A model that timed out this many times in a row is skipped for
+# TIMEOUT_COOLDOWN seconds, so a degraded model is not waited on every request
+TIMEOUT_STREAK = int(os.getenv("MODEL_TIMEOUT_STREAK", 2))
+TIMEOUT_COOLDOWN = float(os.getenv("MODEL_TIMEOUT_COOLDOWN", 15))
+# Weight of the newest sample in the per-model latency average
+LATENCY_SMOOTHING = 0.2
+
+
+def _route(route: Any) -> Dict[str, Any]:
+    return {"candidates": route} if isinstance(route, list) else route
+
+
+def load_routes() -> Dict[str, Dict[str, Any]]:
+    routes = dict(DEFAULT_ROUTES)
+    if os.getenv("MODEL_ROUTES_FILE"):
+        with open(os.environ["MODEL_ROUTES_FILE"]) as f:
+            routes.update(json.load(f))
+    if os.getenv("MODEL_ROUTES"):
+        routes.update(json.loads(os.environ["MODEL_ROUTES"]))
+    return {task: _route(route) for task, route in routes.items()}
+
+
+def input_size(contents: Any) -> int:
+    """Approximate request size in bytes (decoded pixels for PIL images)"""
+    items = contents if isinstance(contents, list) else [contents]
+    size = 0
+    for item in items:
+        if isinstance(item, str):
+            size += len(item.encode("utf-8"))
+        elif isinstance(item, Image.Image):
+            size += item.width * item.height * 3
+        elif isinstance(item, (bytes, bytearray)):
+            size += len(item)
+        elif getattr(item, "inline_data", None) is not None:
+            size += len(item.inline_data.data or b"")
+    return size
+
+
+def _is_retryable(error: Exception) -> Optional[str]:
+    """Return the fallback reason for errors worth trying another model for"""
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+    if isinstance(error, errors.APIError):
+        if error.code == 429:
+            return "rate_limited"
+        if error.code and error.code >= 500:
+            return "server_error"
+    return None
+
+
+class ModelRouter:
+    """Choose a Gemini model per task and fall back along the task's route"""
+
+    def __init__(self, client, routes: Dict[str, Any] = None):
+        self.client = client
+        self.routes = (
+            {task: _route(route) for task, route in routes.items()}
+            if routes
+            else load_routes()
+        )
+        self._cooldown_until: Dict[str, float] = {}
+        self._latency: Dict[str, float] = {}
+        self._timeouts: Dict[str, int] = {}
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def drain(self, timeout: float) -> bool:
+        """Wait for in-flight model calls to finish; False if the timeout hit first"""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def candidates(
+        self, task: str, size: int, latency_budget: Optional[float]
+    ) -> List[Dict[str, Any]]:
+        route = self.routes[task]["candidates"]
+        now = time.monotonic()
+        chosen = []
+        for c in route:
+            if size > c.get("max_input_bytes", size):
+                reason = "input_size"
+            elif self._cooldown_until.get(c["model"], 0) > now:
+                reason = "cooldown"
+            elif (
+                latency_budget is not None
+                and self._latency.get(c["model"], 0) > latency_budget
+            ):
+                reason = "latency_budget"
+            else:
+                chosen.append(c)
+                continue
+            metrics.inc(
+                "model_candidates_skipped_total",
+                task=task,
+                model=c["model"],
+                reason=reason,
+            )
+        # Never refuse outright: if every model was filtered, try the route anyway
+        return chosen or list(route)
+
+    async def generate(
+        self,
+        task: str,
+        contents: Any,
+        latency_budget: Optional[float] = None,
+        config: Any = None,
+    ):
+        """
+        Run generate_content for a task, falling back to the next candidate on
+        timeouts, rate limits and server errors. latency_budget (seconds) bounds
+        the total time spent across attempts; it defaults to the task's.
+        """
+        if latency_budget is None:
+            latency_budget = self.routes[task].get("latency_budget")
+        self._in_flight += 1
+        self._idle.clear()
+        try:
+            return await self._generate(task, contents, latency_budget, config)
+        finally:
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self._idle.set()
+
+    async def _generate(
+        self,
+        task: str,
+        contents: Any,
+        latency_budget: Optional[float],
+        config: Any,
+    ):
+        size = input_size(contents)
+        deadline = time.monotonic() + latency_budget if latency_budget else None
+        last_error: Optional[Exception] = None
+        previous_model = None
+
+        for candidate in self.candidates(task, size, latency_budget):
+            model = candidate["model"]
+            full_timeout = timeout = candidate.get("timeout", 60)
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.monotonic())
+                if timeout <= 0:
+                    break
+            if previous_model is not None:
+                metrics.inc(
+                    "model_fallbacks_total",
+                    task=task,
+                    from_model=previous_model,
+                    to_model=model,
+                    reason=_is_retryable(last_error),
+                )
+
+            with tracing.span(
+                "gemini.generate_content",
+                {
+                    "gen_ai.system": "gemini",
+                    "gen_ai.request.model": model,
+                    "app.task": task,
+                    "app.input_bytes": size,
+                    "app.timeout_s": timeout,
+                },
+            ) as span:
+                start = time.monotonic()
+                try:
+                    response = await asyncio.wait_for(
+                        self.client.aio.models.generate_content(
+                            model=model, contents=contents, config=config
+                        ),
+                        timeout,
+                    )
+                except Exception as e:
+                    elapsed = time.monotonic() - start
+                    reason = _is_retryable(e)
+                    metrics.inc(
+                        "model_calls_total", task=task, model=model, outcome=reason or "error"
+                    )
+                    metrics.observe("model_latency_seconds", elapsed, task=task, model=model)
+                    if reason is None:
+                        raise
+                    span.set_attribute("app.outcome", reason)
+                    if reason == "rate_limited":
+                        self._cooldown_until[model] = (
+                            time.monotonic() + RATE_LIMIT_COOLDOWN
+                        )
+                    elif reason == "timeout" and timeout >= full_timeout:
+                        # Cut short by the latency budget says nothing about the model
+                        self._record_timeout(model, elapsed)
+                    last_error, previous_model = e, model
+                    continue
+
+                elapsed = time.monotonic() - start
+                span.set_attribute("app.outcome", "ok")
+                self._record_success(task, model, elapsed, response, span)
+                return response
+
+        if last_error is not None:
+            raise last_error
+        raise asyncio.TimeoutError(f"No model for {task} fits the latency budget")
+
+    def _record_latency(self, model: str, elapsed: float):
+        previous = self._latency.get(model)
+        self._latency[model] = (
+            elapsed
+            if previous is None
+            else previous + LATENCY_SMOOTHING * (elapsed - previous)
+        )
+
+    def _record_timeout(self, model: str, elapsed: float):
+        # The timeout is a lower bound on the latency the request would have had
+        self._record_latency(model, elapsed)
+        self._timeouts[model] = self._timeouts.get(model, 0) + 1
+        if self._timeouts[model] >= TIMEOUT_STREAK:
+            self._cooldown_until[model] = time.monotonic() + TIMEOUT_COOLDOWN
+            self._timeouts[model] = 0
+
+    def _record_success(
+        self, task: str, model: str, elapsed: float, response: Any, span: Any
+    ):
+        self._record_latency(model, elapsed)
+        self._timeouts.pop(model, None)
+        metrics.inc("model_calls_total", task=task, model=model, outcome="ok")
+        metrics.observe("model_latency_seconds", elapsed, task=task, model=model)
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            span.set_attributes(
+                {
+                    "gen_ai.usage.input_tokens": usage.prompt_token_count or 0,
+                    "gen_ai.usage.output_tokens": usage.candidates_token_count or 0,
+                }
+            )
+            metrics.inc(
+                "model_tokens_total",
+                usage.prompt_token_count or 0,
+                task=task,
+                model=model,
+                kind="prompt",
+            )
+            metrics.inc(
+                "model_tokens_total",
+                usage.candidates_token_count or 0,
+                task=task,
+                model=model,
+                kind="output",
+            )
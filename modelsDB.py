@@ -1,15 +1,47 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Union
 from datetime import datetime
 from pydantic import Field  
 
 # Response models
 class TitleResponse(BaseModel):
-    titles: List[str]
+    titles: List[str] = []
+    record_id: str = ""
 
 
 class StoryResponse(BaseModel):
-    stories: List[str]
+    stories: List[str] = []
+    record_id: str = ""
+
+
+class ImageRef(BaseModel):
+    image_id: str
+    url: str
+    mime_type: str
+
+
+class ImagesNameCategoryResponse(BaseModel):
+    images: List[Union[str, ImageRef]] = []
+    image_ids: List[str] = []
+    titles: List[str] = []
+    category: str = ""
+    image_id: str = ""
+
+
+class TagsCaptionsResponse(BaseModel):
+    seo_tags: List[str] = []
+    hashtags: List[str] = []
+    captions: List[str] = []
+    image_id: str = ""
+    record_id: str = ""
+
+
+class RegeneratedResponse(BaseModel):
+    record_id: str = ""
+    parent_id: str = ""
+    field: str = ""
+    index: Optional[int] = None
+    values: Dict[str, List[str]] = {}
 
 
 class GeneratedContent(BaseModel):
@@ -18,6 +50,33 @@ class GeneratedContent(BaseModel):
     message: str
 
 
+# Typed variants of GeneratedContent, one per generation endpoint. Failed
+# generations still send data={}, so every data field has a default.
+class TitlesContent(GeneratedContent):
+    data: TitleResponse
+
+
+class StoriesContent(GeneratedContent):
+    data: StoryResponse
+
+
+class ImagesNameCategoryContent(GeneratedContent):
+    data: ImagesNameCategoryResponse
+
+
+class TagsCaptionsContent(GeneratedContent):
+    data: TagsCaptionsResponse
+
+
+class RegeneratedContent(GeneratedContent):
+    data: RegeneratedResponse
+
+
+class ProductsResponse(BaseModel):
+    status: str
+    products: List[Dict[str, Any]]
+
+
 class Product(BaseModel):
     name: str = Field(..., description="Product name")
     category: str = Field(
@@ -35,3 +94,12 @@ class Product(BaseModel):
     images: List[str] = []
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
+    version: int = Field(0, description="Incremented on every write")
+
+
+class Tenant(BaseModel):
+    tenant_id: str
+    name: str
+    request_budget: int = Field(0, description="Requests per month, 0 for unlimited")
+    token_budget: int = Field(0, description="Tokens per month, 0 for unlimited")
+    active: bool = True
@@ -0,0 +1,194 @@
+import os
+from typing import Any, Dict, List, Union
+
+import orjson
+
+# Most items kept per field
+TITLE_COUNT = 3
+STORY_COUNT = 3
+SEO_TAG_COUNT = 5
+HASHTAG_COUNT = 7
+CAPTION_COUNT = 3
+# Fields regenerated one variant at a time; the others are regenerated whole
+SINGLE_VARIANT_FIELDS = {"titles", "stories", "captions"}
+TAG_COUNTS = {"seo_tags": SEO_TAG_COUNT, "hashtags": HASHTAG_COUNT}
+
+STORY_MARKER = "---STORY---"
+
+# "reference" is the original multi-pass parsing; "single-pass" gives the same
+# results in one scan (checked by benchmarks/bench_parsers.py)
+RESPONSE_PARSER = os.getenv("RESPONSE_PARSER", "single-pass")
+# Path of a JSONL file to append every raw model output to, for growing the
+# parser corpus (see benchmarks/bench_parsers.py --add)
+PARSER_CORPUS_FILE = os.getenv("PARSER_CORPUS_FILE")
+
+
+def fallback_story(category: str, location: str) -> str:
+    return f"This {category} from {location} reflects the tradition of craftsmanship, blending creativity and culture."
+
+
+def split_hashtags(text: str) -> List[str]:
+    """Hashtags separated by commas and/or whitespace, one tag per item"""
+    return text.replace(",", " ").split()
+
+
+class ReferenceParser:
+    """Turns raw model text into response fields; the behaviour the corpus records"""
+
+    name = "reference"
+
+    def product_names(self, text: str) -> List[str]:
+        return [line.strip() for line in text.split("\n") if line.strip()]
+
+    def titles(self, text: str) -> List[str]:
+        text = text.strip()
+        titles = [title.strip() for title in text.split("\n") if title.strip()]
+        return titles[:TITLE_COUNT]
+
+    def stories(self, text: str, category: str, location: str) -> List[str]:
+        text = text.strip()
+        # Split stories by marker
+        if STORY_MARKER in text:
+            stories = [s.strip() for s in text.split(STORY_MARKER) if s.strip()]
+        else:
+            stories = [text] if text else []
+
+        # Ensure exactly 3 stories
+        while len(stories) < STORY_COUNT:
+            stories.append(fallback_story(category, location))
+        return stories[:STORY_COUNT]
+
+    def tags_captions(self, text: str) -> Dict[str, List[str]]:
+        seo_tags = []
+        hashtags = []
+        captions = []
+
+        # Simple parsing logic (adjust based on LLM output format)
+        lines = [line.strip() for line in text.strip().split("\n") if line.strip()]
+        for line in lines:
+            if line.lower().startswith("seo tags:"):
+                seo_tags = [
+                    tag.strip()
+                    for tag in line[len("seo tags:") :].split(",")
+                    if tag.strip()
+                ]
+            elif line.lower().startswith("hashtags:"):
+                hashtags = split_hashtags(line[len("hashtags:") :])
+            elif line.lower().startswith("captions:"):
+                captions = [
+                    cap.strip()
+                    for cap in line[len("captions:") :].split("|")
+                    if cap.strip()
+                ]
+
+        # Fallback if not parsed
+        if not seo_tags:
+            seo_tags = [line for line in lines if line.startswith("#SEO")][
+                :SEO_TAG_COUNT
+            ]
+        if not hashtags:
+            hashtags = [
+                tag
+                for line in lines
+                if line.startswith("#")
+                for tag in split_hashtags(line)
+            ][:HASHTAG_COUNT]
+        if not captions:
+            captions = [
+                line
+                for line in lines
+                if not line.startswith("#")
+                and not line.lower().startswith("seo tags")
+                and not line.lower().startswith("hashtags")
+            ][:CAPTION_COUNT]
+
+        # Limit counts
+        return {
+            "seo_tags": seo_tags[:SEO_TAG_COUNT],
+            "hashtags": hashtags[:HASHTAG_COUNT],
+            "captions": captions[:CAPTION_COUNT],
+        }
+
+    def regenerated(self, text: str, field: str) -> Union[str, List[str]]:
+        """Parse a regeneration reply: one string for variants, a list for tag fields"""
+        text = text.strip()
+        if field == "stories":
+            return text.replace(STORY_MARKER, "").strip()
+        lines = [line.strip() for line in text.split("\n") if line.strip()]
+        if field in SINGLE_VARIANT_FIELDS:
+            line = lines[0] if lines else ""
+            if line.lower().startswith("captions:"):
+                line = line[len("captions:") :].strip()
+            return line
+        joined = " ".join(lines)
+        for heading in ("seo tags:", "hashtags:"):
+            if joined.lower().startswith(heading):
+                joined = joined[len(heading) :]
+        if field == "hashtags":
+            return split_hashtags(joined)[: TAG_COUNTS[field]]
+        return [tag.strip() for tag in joined.split(",") if tag.strip()][
+            : TAG_COUNTS[field]
+        ]
+
+
+class SinglePassParser(ReferenceParser):
+    """
+    Same results as ReferenceParser, but tags and captions come from one scan
+    of the lines that fills the headed fields and their fallbacks together.
+    """
+
+    name = "single-pass"
+
+    def titles(self, text: str) -> List[str]:
+        titles = []
+        for line in text.split("\n"):
+            line = line.strip()
+            if line:
+                titles.append(line)
+                if len(titles) == TITLE_COUNT:
+                    break
+        return titles
+
+    def tags_captions(self, text: str) -> Dict[str, List[str]]:
+        seo_tags = hashtags = captions = None
+        seo_fallback, hashtag_fallback, caption_fallback = [], [], []
+        for line in text.split("\n"):
+            line = line.strip()
+            if not line:
+                continue
+            head = line[:9].lower()
+            if head == "seo tags:":
+                seo_tags = [tag.strip() for tag in line[9:].split(",") if tag.strip()]
+            elif head == "hashtags:":
+                hashtags = split_hashtags(line[9:])
+            elif head == "captions:":
+                captions = [cap.strip() for cap in line[9:].split("|") if cap.strip()]
+            if line[0] == "#":
+                if len(seo_fallback) < SEO_TAG_COUNT and line.startswith("#SEO"):
+                    seo_fallback.append(line)
+                if len(hashtag_fallback) < HASHTAG_COUNT:
+                    hashtag_fallback.extend(split_hashtags(line))
+            elif len(caption_fallback) < CAPTION_COUNT and not (
+                head.startswith("seo tags") or head.startswith("hashtags")
+            ):
+                caption_fallback.append(line)
+        return {
+            "seo_tags": (seo_tags or seo_fallback)[:SEO_TAG_COUNT],
+            "hashtags": (hashtags or hashtag_fallback)[:HASHTAG_COUNT],
+            "captions": (captions or caption_fallback)[:CAPTION_COUNT],
+        }
+
+
+PARSERS = {p.name: p for p in (ReferenceParser(), SinglePassParser())}
+parser = PARSERS[RESPONSE_PARSER]
+
+
+def parse(kind: str, text: str, **args: Any) -> Any:
+    """
+    Parse raw model text with the configured parser. kind is one of
+    product_names, titles, stories, tags_captions or regenerated.
+    """
+    if PARSER_CORPUS_FILE:
+        with open(PARSER_CORPUS_FILE, "ab") as f:
+            f.write(orjson.dumps({"kind": kind, "args": args, "text": text}) + b"\n")
+    return getattr(parser, kind)(text, **args)
@@ -0,0 +1,244 @@
+import asyncio
+import itertools
+import os
+import signal
+import threading
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Any, AsyncIterator, Deque, Dict, Optional, Set, Tuple
+
+from database import db
+
+# "local" pushes the product writes made by this process only, so it suits a
+# single worker; "mongo" follows a Mongo change stream (needs a replica set,
+# e.g. Atlas), so subscribers on any worker see writes from every worker.
+CHANGE_FEED = os.getenv("CHANGE_FEED", "local").lower()
+# Events buffered per subscriber; a subscriber that falls further behind
+# is sent a resync event and disconnected
+SUBSCRIBER_QUEUE = 256
+# Recent events kept so reconnecting clients can resume (Last-Event-ID)
+REPLAY_SIZE = 1000
+HEARTBEAT_SECONDS = 15
+# Large fields left out of events
+OMITTED_FIELDS = ("image_base64",)
+
+RESYNC = {"operation": "resync"}
+
+
+class Subscriber:
+    def __init__(self, product_ids: Optional[Set[str]]):
+        self.product_ids = product_ids
+        self.queue: asyncio.Queue = asyncio.Queue(SUBSCRIBER_QUEUE)
+
+    def wants(self, event: Dict[str, Any]) -> bool:
+        return (
+            not self.product_ids
+            or event.get("product_id") is None
+            or event["product_id"] in self.product_ids
+        )
+
+
+# Event IDs. With the Mongo change stream they are the change's cluster time
+# ("<seconds>.<increment>"), the same on every worker. Local events are only
+# ordered within this process, so their IDs carry a per-process origin and an
+# ID from another worker (or before a restart) cannot be resumed from.
+_origin = uuid.uuid4().hex[:8]
+_local_seq = itertools.count(1)
+
+EventKey = Tuple[int, ...]
+
+_subscribers: Set[Subscriber] = set()
+_recent: Deque[Tuple[EventKey, Dict[str, Any]]] = deque(maxlen=REPLAY_SIZE)
+# Events at or before this key may have been dropped from _recent
+_horizon: Optional[EventKey] = (0,) if CHANGE_FEED == "local" else None
+_watch_task: Optional[asyncio.Task] = None
+# Set once shutdown begins; streams end so the server can drain its connections
+_closing = False
+
+
+def parse_event_id(event_id: Optional[str]) -> Optional[EventKey]:
+    """Ordering key of an event ID, or None if it cannot be resumed from here"""
+    try:
+        if CHANGE_FEED == "local":
+            origin, _, seq = event_id.partition("-")
+            return (int(seq),) if origin == _origin else None
+        seconds, _, increment = event_id.partition(".")
+        return int(seconds), int(increment)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _close(subscriber: Subscriber, final: Optional[Dict[str, Any]]):
+    """Replace whatever the subscriber has queued with a final event and drop it"""
+    while not subscriber.queue.empty():
+        subscriber.queue.get_nowait()
+    subscriber.queue.put_nowait(final)
+    _subscribers.discard(subscriber)
+
+
+def _dispatch(key: EventKey, event: Dict[str, Any]):
+    global _horizon
+    if _horizon is None:
+        # The change stream was opened just before this; earlier events are unknown
+        _horizon = key
+    if len(_recent) == _recent.maxlen:
+        _horizon = _recent[0][0]
+    _recent.append((key, event))
+    for subscriber in list(_subscribers):
+        if not subscriber.wants(event):
+            continue
+        try:
+            subscriber.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Too far behind to catch up event by event; tell it to refetch
+            _close(subscriber, RESYNC)
+
+
+def _event(
+    operation: str,
+    product_id: Optional[str],
+    fields: Dict[str, Any],
+    version: Optional[int],
+    at: datetime,
+) -> Dict[str, Any]:
+    return {
+        "operation": operation,
+        "product_id": product_id,
+        "version": version,
+        "fields": {k: v for k, v in fields.items() if k not in OMITTED_FIELDS},
+        "at": at,
+    }
+
+
+def publish(
+    operation: str,
+    product_id: Optional[str],
+    fields: Dict[str, Any],
+    version: Optional[int] = None,
+    at: datetime = None,
+):
+    """Announce a product write (no-op when the Mongo change stream is the source)"""
+    if CHANGE_FEED == "local":
+        seq = next(_local_seq)
+        event = _event(operation, product_id, fields, version, at or datetime.utcnow())
+        event["id"] = f"{_origin}-{seq}"
+        _dispatch((seq,), event)
+
+
+def _from_change(change: Dict[str, Any]) -> Dict[str, Any]:
+    operation = change["operationType"]
+    if operation == "insert":
+        fields = dict(change.get("fullDocument") or {})
+        fields.pop("_id", None)
+    elif operation == "update":
+        fields = change["updateDescription"]["updatedFields"]
+    else:
+        fields = {}
+    event = _event(
+        operation,
+        str(change["documentKey"]["_id"]),
+        fields,
+        fields.get("version"),
+        fields.get("updated_at") or datetime.utcnow(),
+    )
+    event["id"] = f"{change['clusterTime'].time}.{change['clusterTime'].inc}"
+    return event
+
+
+async def _watch():
+    resume_token = None
+    while True:
+        try:
+            async with db["product"].watch(resume_after=resume_token) as stream:
+                async for change in stream:
+                    resume_token = stream.resume_token
+                    event = _from_change(change)
+                    _dispatch(parse_event_id(event["id"]), event)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Product change stream failed, retrying: {e}")
+            await asyncio.sleep(5)
+
+
+def _close_all():
+    global _closing
+    _closing = True
+    for subscriber in list(_subscribers):
+        _close(subscriber, None)
+
+
+def _close_on_exit_signals():
+    """
+    End every stream as soon as the server is told to stop. The server waits
+    for open connections before running shutdown hooks, so waiting for stop()
+    would hold every shutdown for the full graceful timeout.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        previous = signal.getsignal(sig)
+
+        def handler(signum, frame, previous=previous):
+            loop.call_soon_threadsafe(_close_all)
+            if callable(previous):
+                previous(signum, frame)
+
+        signal.signal(sig, handler)
+
+
+def start():
+    global _watch_task
+    _close_on_exit_signals()
+    if CHANGE_FEED == "mongo" and _watch_task is None:
+        _watch_task = asyncio.create_task(_watch())
+
+
+async def stop():
+    global _watch_task
+    if _watch_task is not None:
+        _watch_task.cancel()
+        _watch_task = None
+    _close_all()
+
+
+async def subscribe(
+    product_ids: Optional[Set[str]] = None, after: Optional[str] = None
+) -> AsyncIterator[Optional[Dict[str, Any]]]:
+    """
+    Yield product events as they happen, starting with buffered events newer
+    than the event ID `after`. If the events after it are no longer all known
+    here, the first event is RESYNC. Yields None as a heartbeat when idle and
+    ends after a RESYNC event or once shutdown begins (clients reconnect with
+    the last event ID).
+    """
+    if _closing:
+        return
+    subscriber = Subscriber(product_ids)
+    _subscribers.add(subscriber)
+    try:
+        if after is not None:
+            key = parse_event_id(after)
+            if key is None or _horizon is None or key < _horizon:
+                yield RESYNC
+                return
+            for event_key, event in list(_recent):
+                if event_key > key and subscriber.wants(event):
+                    yield event
+        while True:
+            try:
+                event = await asyncio.wait_for(
+                    subscriber.queue.get(), HEARTBEAT_SECONDS
+                )
+            except asyncio.TimeoutError:
+                yield None
+                continue
+            if event is None:
+                return
+            yield event
+            if event is RESYNC:
+                return
+    finally:
+        _subscribers.discard(subscriber)
@@ -0,0 +1,267 @@
+import asyncio
+import heapq
+import math
+import os
+import re
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo.errors import OperationFailure
+
+from database import db
+
+# "mongo" uses the collection's text index; "memory" keeps an inverted index
+# in this process (for local runs without a text-capable Mongo). Mongo errors
+# such as a missing text index also fall back to the in-process index, and
+# Mongo is tried again after MONGO_RETRY_SECONDS.
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "mongo").lower()
+REFRESH_SECONDS = 300
+MONGO_RETRY_SECONDS = 60
+# Longest stretch of indexing before requests get a turn on the event loop
+BUILD_SLICE_SECONDS = 0.005
+FACET_LIMIT = 20
+MAX_PAGE_SIZE = 100
+
+# Relative weight of a match per field, used for both backends
+FIELD_WEIGHTS = {
+    "name": 10,
+    "title": 8,
+    "hashtags": 5,
+    "seo_tags": 5,
+    "caption": 3,
+    "story": 1,
+}
+FACET_FIELDS = ("category", "location")
+
+_TOKEN = re.compile(r"\w+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from in is it of on or the this to with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens without stopwords, with plural 's' stripped"""
+    tokens = []
+    for token in _TOKEN.findall(unicodedata.normalize("NFKC", text or "").lower()):
+        if token in _STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def _field_text(value: Any) -> str:
+    return " ".join(value) if isinstance(value, list) else str(value or "")
+
+
+class InvertedIndex:
+    """Weighted term -> document postings with tf-idf ranking and facet counts"""
+
+    def __init__(self):
+        self.ids: List[Any] = []
+        self.facets: Dict[str, List[str]] = {field: [] for field in FACET_FIELDS}
+        self.postings: Dict[str, Dict[int, float]] = defaultdict(dict)
+
+    def add(self, product: Dict[str, Any]):
+        doc = len(self.ids)
+        self.ids.append(product["_id"])
+        for field in FACET_FIELDS:
+            self.facets[field].append(product.get(field) or "")
+        weights = Counter()
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(_field_text(product.get(field))):
+                weights[token] += weight
+        for token, weight in weights.items():
+            self.postings[token][doc] = weight
+
+    def _filtered(self, docs: Iterable[int], filters: Dict[str, str]) -> List[int]:
+        docs = list(docs)
+        for field, value in filters.items():
+            values = self.facets[field]
+            docs = [doc for doc in docs if values[doc] == value]
+        return docs
+
+    def search(
+        self, query: str, filters: Dict[str, str], skip: int, limit: int
+    ) -> Tuple[int, List[Tuple[Any, float]], Dict[str, List[Dict[str, Any]]]]:
+        """
+        Return (total, [(id, score)] for the page, facets). Any query term may
+        match; documents matching more and rarer terms rank higher. An empty
+        query matches everything, newest first.
+        """
+        terms = set(tokenize(query))
+        scores: Dict[int, float] = defaultdict(float)
+        for term in terms:
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + len(self.ids) / len(postings))
+            for doc, weight in postings.items():
+                scores[doc] += weight * idf
+        candidates = scores if terms else range(len(self.ids))
+
+        # Each facet is counted with the other filters applied, so the
+        # alternatives to a selected value stay visible
+        facets = {}
+        for field in FACET_FIELDS:
+            others = {f: v for f, v in filters.items() if f != field}
+            docs = self._filtered(candidates, others) if others else candidates
+            facets[field] = _facet_list(
+                Counter(map(self.facets[field].__getitem__, docs)).items()
+            )
+
+        matched = self._filtered(candidates, filters)
+        if terms:
+            page = heapq.nlargest(
+                skip + limit, matched, key=lambda doc: (scores[doc], doc)
+            )[skip:]
+        else:
+            page = matched[::-1][skip : skip + limit]
+        return (
+            len(matched),
+            [(self.ids[doc], scores.get(doc, 0.0)) for doc in page],
+            facets,
+        )
+
+
+def _facet_list(counts: Iterable[Tuple[str, int]]) -> List[Dict[str, Any]]:
+    ranked = sorted(((v, c) for v, c in counts if v), key=lambda vc: (-vc[1], vc[0]))
+    return [{"value": value, "count": count} for value, count in ranked[:FACET_LIMIT]]
+
+
+# Monotonic time from which Mongo text search is used (again)
+_mongo_after = 0.0 if SEARCH_BACKEND == "mongo" else math.inf
+_index: Optional[InvertedIndex] = None
+_loaded_at: Optional[float] = None
+_building: Optional[asyncio.Task] = None
+
+
+async def _build() -> InvertedIndex:
+    global _index, _loaded_at
+    index = InvertedIndex()
+    projection = {field: 1 for field in (*FIELD_WEIGHTS, *FACET_FIELDS)}
+    cursor = db["product"].find({}, projection).sort("_id", 1).batch_size(1000)
+    slice_end = time.monotonic() + BUILD_SLICE_SECONDS
+    async for product in cursor:
+        index.add(product)
+        # Indexing is CPU-bound; let requests run every few milliseconds
+        if time.monotonic() >= slice_end:
+            await asyncio.sleep(0)
+            slice_end = time.monotonic() + BUILD_SLICE_SECONDS
+    _index, _loaded_at = index, time.monotonic()
+    return index
+
+
+async def _ensure_loaded() -> InvertedIndex:
+    """The current index; stale ones keep serving while a rebuild runs"""
+    global _building
+    stale = _loaded_at is None or time.monotonic() - _loaded_at >= REFRESH_SECONDS
+    if stale and (_building is None or _building.done()):
+        _building = asyncio.create_task(_build())
+    if _index is None:
+        return await asyncio.shield(_building)
+    return _index
+
+
+async def _search_memory(
+    query: str, filters: Dict[str, str], skip: int, limit: int
+) -> Dict[str, Any]:
+    index = await _ensure_loaded()
+    total, page, facets = index.search(query, filters, skip, limit)
+    scores = dict(page)
+    products = await (
+        db["product"]
+        .find({"_id": {"$in": list(scores)}}, {"image_base64": 0})
+        .to_list(length=None)
+    )
+    for product in products:
+        product["score"] = scores[product["_id"]]
+    products.sort(key=lambda p: p["score"], reverse=True)
+    return {"total": total, "products": products, "facets": facets}
+
+
+async def _search_mongo(
+    query: str, filters: Dict[str, str], skip: int, limit: int
+) -> Dict[str, Any]:
+    def facet(field: str) -> List[Dict[str, Any]]:
+        others = {f: v for f, v in filters.items() if f != field}
+        return [
+            {"$match": others},
+            {"$group": {"_id": f"${field}", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1, "_id": 1}},
+            {"$limit": FACET_LIMIT + 1},
+        ]
+
+    if query.strip():
+        pipeline = [
+            {"$match": {"$text": {"$search": query}}},
+            {"$addFields": {"score": {"$meta": "textScore"}}},
+        ]
+        order = {"score": -1, "_id": -1}
+    else:
+        pipeline = [{"$addFields": {"score": 0.0}}]
+        order = {"_id": -1}
+    pipeline.append(
+        {
+            "$facet": {
+                "products": [
+                    {"$match": filters},
+                    {"$sort": order},
+                    {"$skip": skip},
+                    {"$limit": limit},
+                    {"$project": {"image_base64": 0}},
+                ],
+                "total": [{"$match": filters}, {"$count": "count"}],
+                **{field: facet(field) for field in FACET_FIELDS},
+            }
+        }
+    )
+    result = (await db["product"].aggregate(pipeline).to_list(length=1))[0]
+    return {
+        "total": result["total"][0]["count"] if result["total"] else 0,
+        "products": result["products"],
+        "facets": {
+            field: _facet_list((g["_id"], g["count"]) for g in result[field])
+            for field in FACET_FIELDS
+        },
+    }
+
+
+async def search(
+    query: str,
+    category: Optional[str] = None,
+    location: Optional[str] = None,
+    page: int = 1,
+    page_size: int = 20,
+) -> Dict[str, Any]:
+    """Ranked, paginated product search with category and location facets"""
+    filters = {
+        field: value
+        for field, value in (("category", category), ("location", location))
+        if value
+    }
+    skip = (page - 1) * page_size
+    global _mongo_after
+    if time.monotonic() >= _mongo_after:
+        try:
+            return await _search_mongo(query, filters, skip, page_size)
+        except OperationFailure as e:
+            print(
+                "Mongo text search failed, using the in-process index"
+                f" for {MONGO_RETRY_SECONDS}s: {e}"
+            )
+            _mongo_after = time.monotonic() + MONGO_RETRY_SECONDS
+    return await _search_memory(query, filters, skip, page_size)
+
+
+async def ensure_indexes():
+    await db["product"].create_index(
+        [(field, "text") for field in FIELD_WEIGHTS],
+        weights=FIELD_WEIGHTS,
+        name="product_text",
+    )
+    for field in FACET_FIELDS:
+        await db["product"].create_index(field)
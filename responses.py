@@ -0,0 +1,74 @@
+import uuid
+from typing import Any, Dict, List, Tuple
+
+import orjson
+from bson import ObjectId
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Accept this media type on /gen-images-name-category to get image IDs and URLs
+# instead of inline data URIs.
+IMAGE_REFS_MEDIA_TYPE = "application/vnd.artisan.image-refs+json"
+
+
+def _orjson_default(value: Any) -> Any:
+    """Serialize types orjson does not know natively (Mongo ObjectIds)"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_orjson_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered with orjson; Mongo documents can be returned as-is"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def negotiate_images_format(accept: str) -> str:
+    """
+    Pick the response format for generated images from the Accept header.
+    Returns "multipart", "refs" or "data-uri" (the default for old clients).
+    """
+    accept = (accept or "").lower()
+    if "multipart/mixed" in accept:
+        return "multipart"
+    if IMAGE_REFS_MEDIA_TYPE in accept:
+        return "refs"
+    return "data-uri"
+
+
+def multipart_response(
+    metadata: Dict[str, Any], parts: List[Tuple[bytes, str]]
+) -> StreamingResponse:
+    """
+    Stream a multipart/mixed body: one JSON metadata part, then one raw part
+    per (bytes, mime type) pair, without building the whole body in memory.
+    """
+    boundary = uuid.uuid4().hex
+
+    async def body():
+        metadata_json = dumps(metadata)
+        yield (
+            f"--{boundary}\r\n"
+            "Content-Type: application/json\r\n"
+            'Content-Disposition: inline; name="metadata"\r\n'
+            f"Content-Length: {len(metadata_json)}\r\n\r\n"
+        ).encode("utf-8")
+        yield metadata_json
+        for index, (data, mime_type) in enumerate(parts):
+            yield (
+                f"\r\n--{boundary}\r\n"
+                f"Content-Type: {mime_type}\r\n"
+                f'Content-Disposition: attachment; name="image{index}"\r\n'
+                f"Content-Length: {len(data)}\r\n\r\n"
+            ).encode("utf-8")
+            yield data
+        yield f"\r\n--{boundary}--\r\n".encode("utf-8")
+
+    return StreamingResponse(
+        body(), media_type=f"multipart/mixed; boundary={boundary}"
+    )
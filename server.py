@@ -1,19 +1,80 @@
+from bson import ObjectId
 from database import db
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from fastapi import (
+    Depends,
+    FastAPI,
+    File,
+    Form,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    UploadFile,
+    WebSocket,
+    WebSocketDisconnect,
+)
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from google import genai
-from io import BytesIO
-from PIL import Image
+from google.genai import types
+from contextlib import asynccontextmanager
+from typing import List, Optional, Tuple
+import asyncio
 import os
-import base64
 import uvicorn
 
+import catalogue
+import category_classifier
+import image_store
+import metrics
+import model_recorder
+import parsers
+import product_events
+import product_search
+import shared_state
+import similarity_cache
+import tenants
+import tracing
+import workers
+from model_router import ModelRouter
 from modelsDB import *
 from prompts import *
-from store_into_db_urls import *
+from responses import (
+    IMAGE_REFS_MEDIA_TYPE,
+    ORJSONResponse,
+    dumps,
+    multipart_response,
+    negotiate_images_format,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await image_store.ensure_indexes()
+    await product_search.ensure_indexes()
+    await tenants.ensure_indexes()
+    # Imported here: store_into_db_urls imports app from this module
+    import store_into_db_urls
+
+    await store_into_db_urls.backfill_product_fields()
+    tenants.start_flusher()
+    product_events.start()
+    yield
+    # Let in-flight generations finish so their usage is recorded and flushed
+    await router.drain(SHUTDOWN_TIMEOUT)
+    await tenants.stop_flusher()
+    await product_events.stop()
+    await shared_state.backend.close()
+    workers.shutdown()
+
 
 # Initialize FastAPI app
-app = FastAPI(title="Artisan Product Content Generator", version="1.0.0")
+app = FastAPI(
+    title="Artisan Product Content Generator",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
 
 # Add CORS middleware
 app.add_middleware(
@@ -22,35 +83,46 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID", "traceparent"],
 )
+# Outermost, so the root span covers CORS and body parsing too
+app.add_middleware(tracing.TracingMiddleware)
 
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
+if not GEMINI_API_KEY and model_recorder.GEMINI_MODE != "replay":
     raise ValueError("Please set GEMINI_API_KEY environment variable")
 
-# Initialize the client
-client = genai.Client(api_key=GEMINI_API_KEY)
-
-# Define model names
-TEXT_MODEL = "gemini-2.5-flash"
-IMAGE_GENERATION_MODEL = "gemini-2.5-flash-image"
-
+# Initialize the client; GEMINI_MODE=record/replay saves or replays its
+# responses (see model_recorder)
+client = model_recorder.wrap(
+    genai.Client(api_key=GEMINI_API_KEY) if GEMINI_API_KEY else None
+)
 
-def process_image(image_file: UploadFile) -> Image.Image:
-    """Process uploaded image file and return PIL Image object"""
-    try:
-        # Read image data
-        image_data = image_file.file.read()
+# Seconds a stopping worker waits for in-flight model calls before exiting
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", 30))
 
-        # Convert to PIL Image
-        image = Image.open(BytesIO(image_data))
+# Picks the model per task (see model_router.DEFAULT_ROUTES) and falls back
+# to the next one on timeouts and rate limits
+router = ModelRouter(client)
 
-        # Convert to RGB if necessary
-        if image.mode != "RGB":
-            image = image.convert("RGB")
 
-        return image
+async def process_image(image_data: bytes) -> types.Part:
+    """
+    Turn uploaded image bytes into a model input part. Supported formats are
+    sent as uploaded, so no bitmap is decoded or re-encoded per model call.
+    """
+    try:
+        mime_type = image_store.model_mime_type(image_data)
+        if mime_type is None:
+            with tracing.span("image.encode", {"image.bytes": len(image_data)}):
+                image_data = await workers.run_cpu(
+                    image_store.encode_for_model, image_data
+                )
+            mime_type = "image/jpeg"
+        return types.Part.from_bytes(data=image_data, mime_type=mime_type)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error processing image: {str(e)}")
 
@@ -68,252 +140,717 @@ async def root():
     }
 
 
-@app.post("/gen-images-name-category", response_model=GeneratedContent)
-async def generate_images_name_category(
+@app.post("/images/")
+@tracing.traced()
+async def upload_image(
     image: UploadFile = File(..., description="Artisan product image"),
 ):
     """
-    Generate 3 enhanced images for an artisan product based on the uploaded image.
+    Store an image once and return its ID for use in later requests.
     """
-    try:
-        if not image.content_type.startswith("image/"):
-            raise HTTPException(status_code=400, detail="File must be an image")
+    _, record = await image_store.resolve_upload(image, None)
+    return {
+        "status": "success",
+        "image_id": record["image_id"],
+        "deduplicated": record["deduplicated"],
+    }
 
-        processed_image = process_image(image)
-        image_generation_prompt = generate_images_prompt()
-        category_generation_prompt = category_prompt()
-        title_generation_prompt = product_name_prompt()
 
-        image_response = client.models.generate_content(
-            model=IMAGE_GENERATION_MODEL,
-            contents=[processed_image, image_generation_prompt],
-        )
-        category_response = client.models.generate_content(
-            model=IMAGE_GENERATION_MODEL,
-            contents=[processed_image, category_generation_prompt],
-        )
-        title_response = client.models.generate_content(
-            model=IMAGE_GENERATION_MODEL,
-            contents=[processed_image, title_generation_prompt],
+@app.get("/images/{image_id}")
+async def get_image(image_id: str, size: int = None):
+    """
+    Return the raw bytes of a stored image, optionally a thumbnail of the given width.
+    """
+    record = await image_store.get_image_variant(image_id, size)
+    return Response(
+        content=record["data"],
+        media_type=record["mime_type"],
+        headers={"Cache-Control": "public, max-age=31536000, immutable"},
+    )
+
+
+async def images_response(
+    request: Request,
+    images_format: str,
+    images: List[Tuple[bytes, str]],
+    data: dict,
+):
+    """Render generated images in the negotiated format"""
+    message = "Images generated successfully."
+    if images_format == "multipart":
+        metadata = ImagesNameCategoryContent(success=True, data=data, message=message)
+        return multipart_response(metadata.model_dump(exclude_unset=True), images)
+    if images_format == "refs":
+        data = {
+            **data,
+            "images": [
+                {
+                    "image_id": generated_id,
+                    "url": str(request.url_for("get_image", image_id=generated_id)),
+                    "mime_type": mime_type,
+                }
+                for generated_id, (_, mime_type) in zip(data["image_ids"], images)
+            ],
+        }
+        result = ImagesNameCategoryContent(success=True, data=data, message=message)
+        return ORJSONResponse(
+            result.model_dump(exclude_unset=True), media_type=IMAGE_REFS_MEDIA_TYPE
         )
+    data_uris = await workers.run_cpu(image_store.encode_data_uris, images)
+    return ImagesNameCategoryContent(
+        success=True, data={**data, "images": data_uris}, message=message
+    )
+
+
+@app.post(
+    "/gen-images-name-category",
+    response_model=ImagesNameCategoryContent,
+    response_model_exclude_unset=True,
+)
+@tracing.traced()
+async def generate_images_name_category(
+    request: Request,
+    image: UploadFile = File(None, description="Artisan product image"),
+    image_id: str = Form(None, description="ID of a previously stored image"),
+    tenant: Tenant = Depends(tenants.require_tenant),
+):
+    """
+    Generate 3 enhanced images for an artisan product based on the uploaded image.
+    The Accept header selects data URIs in JSON (default), image IDs and URLs
+    (application/vnd.artisan.image-refs+json) or raw image parts (multipart/mixed).
+    """
+    images_format = negotiate_images_format(request.headers.get("accept"))
+    try:
+        image_data, image_record = await image_store.resolve_upload(image, image_id)
 
-        generated_images_data = []
-        for part in image_response.candidates[0].content.parts:
-            if part.inline_data:
-                # The Gemini API provides image data as inline data
-                img_data = part.inline_data.data
-                img_str = base64.b64encode(img_data).decode("utf-8")
-                generated_images_data.append(
-                    f"data:{part.inline_data.mime_type};base64,{img_str}"
+        # Identical concurrent requests share one generation
+        async def generate():
+            cached = await image_store.find_cached_result(
+                image_record["phash"], "images-name-category", image=image_record
+            )
+            if cached is not None:
+                return await image_store.load_images(cached["image_ids"]), cached
+
+            processed_image = await process_image(image_data)
+            image_generation_prompt = generate_images_prompt()
+            category_generation_prompt = category_prompt()
+            title_generation_prompt = product_name_prompt()
+
+            # Confident local predictions skip the LLM category call. That
+            # saves tokens, not time, so it runs alongside the other calls.
+            async def categorize():
+                local = await category_classifier.classify(image_data)
+                if local and local[2]:
+                    return local, None
+                response = await router.generate(
+                    "category", [processed_image, category_generation_prompt]
+                )
+                return local, response
+
+            # The calls are independent, so run them concurrently
+            image_response, title_response, (local_category, category_response) = (
+                await asyncio.gather(
+                    router.generate(
+                        "image-generation", [processed_image, image_generation_prompt]
+                    ),
+                    router.generate(
+                        "product-names", [processed_image, title_generation_prompt]
+                    ),
+                    categorize(),
+                )
+            )
+            for model_response in (image_response, title_response, category_response):
+                if model_response is not None:
+                    await tenants.record_usage(tenant, model_response)
+            if category_response is not None:
+                generated_category = category_response.text.strip()
+                category_classifier.record_llm_category(
+                    local_category, generated_category
                 )
+            else:
+                generated_category = local_category[0]
+
+            # The Gemini API provides image data as inline data
+            generated_images = [
+                (part.inline_data.data, part.inline_data.mime_type)
+                for part in image_response.candidates[0].content.parts
+                if part.inline_data
+            ]
 
-        generated_titles = title_response.text.split("\n")
-        generated_category = category_response.text.strip()
+            generated_titles = parsers.parse("product_names", title_response.text)
 
-        if len(generated_images_data) == 0:
-            raise Exception("API did not return any image data.")
+            if len(generated_images) == 0:
+                raise Exception("API did not return any image data.")
 
-        result = GeneratedContent(
-            success=True,
-            data={
-                "images": generated_images_data,
+            # Generated images live in the image store; records refer to them by ID
+            generated_records = await asyncio.gather(
+                *(
+                    image_store.store_image(data, mime)
+                    for data, mime in generated_images
+                )
+            )
+            data = {
+                "image_ids": [record["image_id"] for record in generated_records],
                 "titles": generated_titles,
                 "category": generated_category,
-            },
-            message="Images generated successfully.",
-        )
+            }
+
+            # ⬇️ Save to DB
+            with tracing.span("mongo.insert_one", {"db.collection.name": "images"}):
+                await db["images"].insert_one(
+                    GeneratedContent(
+                        success=True,
+                        data=data,
+                        message="Images generated successfully.",
+                    ).model_dump()
+                )
+            await image_store.cache_result(
+                image_record["image_id"],
+                image_record["phash"],
+                "images-name-category",
+                data,
+                image=image_record,
+            )
+            return generated_images, data
 
-        # ⬇️ Save to DB
-        if result.success:
-            await db["images"].insert_one(result.model_dump())
-        return result
+        generated_images, data = await shared_state.single_flight(
+            f"images-name-category:{image_record['image_id']}", generate
+        )
+        return await images_response(
+            request,
+            images_format,
+            generated_images,
+            {**data, "image_id": image_record["image_id"]},
+        )
 
     except Exception as e:
-        return GeneratedContent(
+        return ImagesNameCategoryContent(
             success=False, data={}, message=f"Error generating images: {str(e)}"
         )
 
 
-@app.post("/gen-titles", response_model=GeneratedContent)
+@app.post(
+    "/gen-titles", response_model=TitlesContent, response_model_exclude_unset=True
+)
+@tracing.traced()
 async def generate_titles(
     user_title: str = Form(..., description="User provided title"),
     location: str = Form(..., description="Location/origin of the product"),
     category: str = Form(..., description="Product category"),
+    tenant: Tenant = Depends(tenants.require_tenant),
 ):
     """
     Generate 3 creative titles for an artisan product based on the uploaded image and context.
     """
     try:
-        prompt = generate_titles_prompt(user_title, location, category)
-        response = client.models.generate_content(model=TEXT_MODEL, contents=prompt)
-        titles_text = response.text.strip()
-        titles = [title.strip() for title in titles_text.split("\n") if title.strip()]
-        titles = titles[:3]
-        result = GeneratedContent(
-            success=True,
-            data={"titles": titles},
-            message="Titles generated successfully",
+        request_fields = {
+            "user_title": user_title,
+            "location": location,
+            "category": category,
+        }
+
+        # Identical concurrent requests share one generation
+        async def generate():
+            cached = await similarity_cache.lookup("titles", request_fields)
+            if cached is not None:
+                return TitlesContent(
+                    success=True, data=cached, message="Titles generated successfully"
+                )
+
+            prompt = generate_titles_prompt(user_title, location, category)
+            response = await router.generate("titles", prompt)
+            await tenants.record_usage(tenant, response)
+            titles = parsers.parse("titles", response.text)
+            result = TitlesContent(
+                success=True,
+                data={"titles": titles},
+                message="Titles generated successfully",
+            )
+            if result.success:
+                with tracing.span("mongo.insert_one", {"db.collection.name": "titles"}):
+                    record = await db["titles"].insert_one(
+                        {**result.model_dump(), "request": request_fields}
+                    )
+                result.data.record_id = str(record.inserted_id)
+                similarity_cache.add(
+                    "titles",
+                    record.inserted_id,
+                    request_fields,
+                    result.data.model_dump(),
+                )
+            return result
+
+        flight_key = similarity_cache.request_key("titles", request_fields)
+        return await shared_state.single_flight(
+            f"titles:{flight_key}",
+            generate,
+            encode=TitlesContent.model_dump_json,
+            decode=TitlesContent.model_validate_json,
         )
-        if result.success:
-            await db["titles"].insert_one(result.model_dump())
-        return result
 
     except Exception as e:
-        return GeneratedContent(
+        return TitlesContent(
             success=False, data={}, message=f"Error generating titles: {str(e)}"
         )
 
 
-@app.post("/gen-stories", response_model=GeneratedContent)
+@app.post(
+    "/gen-stories", response_model=StoriesContent, response_model_exclude_unset=True
+)
+@tracing.traced()
 async def generate_stories(
     user_title: str = Form(..., description="User provided title"),
     location: str = Form(..., description="Location/origin of the product"),
     category: str = Form(..., description="Product category"),
     description: str = Form(..., description="User provided description"),
+    tenant: Tenant = Depends(tenants.require_tenant),
 ):
     """
     Generate 3 compelling stories for an artisan product based on context.
     """
     try:
-        # Generate the prompt
-        prompt = generate_stories_prompt(user_title, location, category, description)
+        request_fields = {
+            "user_title": user_title,
+            "location": location,
+            "category": category,
+            "description": description,
+        }
+
+        # Identical concurrent requests share one generation
+        async def generate():
+            cached = await similarity_cache.lookup("stories", request_fields)
+            if cached is not None:
+                return StoriesContent(
+                    success=True, data=cached, message="Stories generated successfully"
+                )
 
-        # Call Gemini API
-        response = client.models.generate_content(model=TEXT_MODEL, contents=prompt)
-        stories_text = response.text.strip()
+            # Generate the prompt
+            prompt = generate_stories_prompt(
+                user_title, location, category, description
+            )
 
-        # Split stories by marker
-        if "---STORY---" in stories_text:
-            stories = [
-                s.strip() for s in stories_text.split("---STORY---") if s.strip()
-            ]
-        else:
-            stories = [stories_text]
+            # Call Gemini API
+            response = await router.generate("stories", prompt)
+            await tenants.record_usage(tenant, response)
+            stories = parsers.parse(
+                "stories", response.text, category=category, location=location
+            )
 
-        # Ensure exactly 3 stories
-        while len(stories) < 3:
-            stories.append(
-                f"This {category} from {location} reflects the tradition of craftsmanship, blending creativity and culture."
+            result = StoriesContent(
+                success=True,
+                data={"stories": stories},
+                message="Stories generated successfully",
             )
-        stories = stories[:3]
 
-        result = GeneratedContent(
-            success=True,
-            data={"stories": stories},
-            message="Stories generated successfully",
+            # ⬇️ Save to DB
+            if result.success:
+                with tracing.span(
+                    "mongo.insert_one", {"db.collection.name": "stories"}
+                ):
+                    record = await db["stories"].insert_one(
+                        {**result.model_dump(), "request": request_fields}
+                    )
+                result.data.record_id = str(record.inserted_id)
+                similarity_cache.add(
+                    "stories",
+                    record.inserted_id,
+                    request_fields,
+                    result.data.model_dump(),
+                )
+            return result
+
+        flight_key = similarity_cache.request_key("stories", request_fields)
+        return await shared_state.single_flight(
+            f"stories:{flight_key}",
+            generate,
+            encode=StoriesContent.model_dump_json,
+            decode=StoriesContent.model_validate_json,
         )
 
-        # ⬇️ Save to DB
-        if result.success:
-            await db["stories"].insert_one(result.model_dump())
-        return result
-
     except Exception as e:
-        return GeneratedContent(
+        return StoriesContent(
             success=False, data={}, message=f"Error generating stories: {str(e)}"
         )
 
 
-@app.post("/gen-tags-captions", response_model=GeneratedContent)
+@app.post(
+    "/gen-tags-captions",
+    response_model=TagsCaptionsContent,
+    response_model_exclude_unset=True,
+)
+@tracing.traced()
 async def generate_tags_captions(
-    image: UploadFile = File(..., description="Artisan product image"),
+    image: UploadFile = File(None, description="Artisan product image"),
     title: str = Form(..., description="Product title"),
     description: str = Form(..., description="Product description"),
     category: str = Form(..., description="Product category"),
     location: str = Form(..., description="Product location"),
+    image_id: str = Form(None, description="ID of a previously stored image"),
+    tenant: Tenant = Depends(tenants.require_tenant),
 ):
     """
     Generate SEO tags, hashtags, and creative captions for an artisan product.
     """
     try:
-        if not image.content_type.startswith("image/"):
-            raise HTTPException(status_code=400, detail="File must be an image")
+        image_data, image_record = await image_store.resolve_upload(image, image_id)
+        params = image_store.params_key(title, description, category, location)
 
-        processed_image = process_image(image)
-        prompt = generate_tags_captions_prompt(title, description, category, location)
+        # Identical concurrent requests share one generation
+        async def generate():
+            cached = await image_store.find_cached_result(
+                image_record["phash"], "tags-captions", params
+            )
+            if cached is not None:
+                return TagsCaptionsContent(
+                    success=True,
+                    data={**cached, "image_id": image_record["image_id"]},
+                    message="Tags, hashtags, and captions generated successfully.",
+                )
+
+            processed_image = await process_image(image_data)
+            prompt = generate_tags_captions_prompt(
+                title, description, category, location
+            )
+
+            response = await router.generate("tags-captions", [prompt, processed_image])
+            await tenants.record_usage(tenant, response)
+            fields = parsers.parse("tags_captions", response.text)
+
+            result = TagsCaptionsContent(
+                success=True,
+                data=fields,
+                message="Tags, hashtags, and captions generated successfully.",
+            )
+
+            # ⬇️ Save to DB
+            if result.success:
+                with tracing.span(
+                    "mongo.insert_one", {"db.collection.name": "tags_captions"}
+                ):
+                    record = await db["tags_captions"].insert_one(
+                        {
+                            **result.model_dump(),
+                            "request": {
+                                "title": title,
+                                "description": description,
+                                "category": category,
+                                "location": location,
+                                "image_id": image_record["image_id"],
+                            },
+                        }
+                    )
+                result.data.record_id = str(record.inserted_id)
+                await image_store.cache_result(
+                    image_record["image_id"],
+                    image_record["phash"],
+                    "tags-captions",
+                    result.data.model_dump(exclude_unset=True),
+                    params,
+                )
+            result.data.image_id = image_record["image_id"]
+            return result
+
+        flight_key = f"tags-captions:{image_record['image_id']}:{params}"
+        return await shared_state.single_flight(flight_key, generate)
+
+    except Exception as e:
+        return TagsCaptionsContent(
+            success=False, data={}, message=f"Error generating tags/captions: {str(e)}"
+        )
+
+
+# Regenerable field -> history collection it lives in
+REGENERATE_FIELDS = {
+    "titles": "titles",
+    "stories": "stories",
+    "captions": "tags_captions",
+    "seo_tags": "tags_captions",
+    "hashtags": "tags_captions",
+}
+
+
+def regenerate_prompt(field: str, request: dict, keep: List[str]) -> str:
+    if field == "titles":
+        return regenerate_title_prompt(
+            request["user_title"], request["location"], request["category"], keep
+        )
+    if field == "stories":
+        return regenerate_story_prompt(
+            request["user_title"],
+            request["location"],
+            request["category"],
+            request["description"],
+            keep,
+        )
+    if field == "captions":
+        return regenerate_caption_prompt(
+            request["title"],
+            request["description"],
+            request["category"],
+            request["location"],
+            keep,
+        )
+    return regenerate_tags_prompt(
+        field,
+        parsers.TAG_COUNTS[field],
+        request["title"],
+        request["description"],
+        request["category"],
+        request["location"],
+    )
+
+
+@app.post(
+    "/regenerate",
+    response_model=RegeneratedContent,
+    response_model_exclude_unset=True,
+)
+@tracing.traced()
+async def regenerate_field(
+    record_id: str = Form(..., description="record_id returned by a generation call"),
+    field: str = Form(
+        ..., description="titles, stories, captions, seo_tags or hashtags"
+    ),
+    index: int = Form(
+        None, description="Variant to replace (required for titles, stories, captions)"
+    ),
+    tenant: Tenant = Depends(tenants.require_tenant),
+):
+    """
+    Regenerate one title, story or caption (or the SEO tags / hashtags) of an
+    existing generation record, keeping everything else. The result is stored
+    as a new record pointing at the original through parent_id.
+    """
+    try:
+        if field not in REGENERATE_FIELDS:
+            raise HTTPException(status_code=400, detail=f"Unknown field: {field}")
+        collection = REGENERATE_FIELDS[field]
+        record = await db[collection].find_one({"_id": ObjectId(record_id)})
+        if not record:
+            raise HTTPException(status_code=404, detail="Record not found")
+        if not record.get("request"):
+            raise HTTPException(
+                status_code=400,
+                detail="Record has no stored request to regenerate from",
+            )
 
-        response = client.models.generate_content(
-            model=TEXT_MODEL, contents=[prompt, processed_image]
+        values = list(record["data"].get(field, []))
+        if field in parsers.SINGLE_VARIANT_FIELDS:
+            if index is None or not 0 <= index < len(values):
+                raise HTTPException(status_code=400, detail="Invalid variant index")
+            keep = values[:index] + values[index + 1 :]
+        else:
+            keep = []
+
+        task = collection if collection != "tags_captions" else "tags-captions"
+        response = await router.generate(
+            task, regenerate_prompt(field, record["request"], keep)
         )
-        result_text = response.text.strip()
-
-        # Parse the response
-        seo_tags = []
-        hashtags = []
-        captions = []
-
-        # Simple parsing logic (adjust based on LLM output format)
-        lines = [line.strip() for line in result_text.split("\n") if line.strip()]
-        for line in lines:
-            if line.lower().startswith("seo tags:"):
-                seo_tags = [
-                    tag.strip()
-                    for tag in line[len("seo tags:") :].split(",")
-                    if tag.strip()
-                ]
-            elif line.lower().startswith("hashtags:"):
-                hashtags = [
-                    tag.strip()
-                    for tag in line[len("hashtags:") :].split(",")
-                    if tag.strip()
-                ]
-            elif line.lower().startswith("captions:"):
-                captions = [
-                    cap.strip()
-                    for cap in line[len("captions:") :].split("|")
-                    if cap.strip()
-                ]
-
-        # Fallback if not parsed
-        if not seo_tags:
-            seo_tags = [line for line in lines if line.startswith("#SEO")][:5]
-        if not hashtags:
-            hashtags = [line.split(" ") for line in lines if line.startswith("#")][:7]
-        if not captions:
-            captions = [
-                line
-                for line in lines
-                if not line.startswith("#")
-                and not line.lower().startswith("seo tags")
-                and not line.lower().startswith("hashtags")
-            ][:3]
-
-        # Limit counts
-        seo_tags = seo_tags[:5]
-        hashtags = hashtags[:7]
-        captions = captions[:3]
-
-        result = GeneratedContent(
+        await tenants.record_usage(tenant, response)
+        regenerated = parsers.parse("regenerated", response.text, field=field)
+        if not regenerated:
+            raise Exception(f"API returned an empty {field} value.")
+        if field in parsers.SINGLE_VARIANT_FIELDS:
+            values[index] = regenerated
+        else:
+            values = regenerated
+
+        data = {**record["data"], field: values}
+        with tracing.span("mongo.insert_one", {"db.collection.name": collection}):
+            inserted = await db[collection].insert_one(
+                {
+                    "success": True,
+                    "data": data,
+                    "message": record.get("message", ""),
+                    "request": record["request"],
+                    "parent_id": record["_id"],
+                    "regenerated": {"field": field, "index": index},
+                }
+            )
+        if collection in similarity_cache.TASK_FIELDS:
+            similarity_cache.add(
+                collection,
+                inserted.inserted_id,
+                record["request"],
+                {**data, "record_id": str(inserted.inserted_id)},
+            )
+        return RegeneratedContent(
             success=True,
             data={
-                "seo_tags": seo_tags,
-                "hashtags": hashtags,
-                "captions": captions,
+                "record_id": str(inserted.inserted_id),
+                "parent_id": record_id,
+                "field": field,
+                "index": index,
+                "values": {k: v for k, v in data.items() if isinstance(v, list)},
             },
-            message="Tags, hashtags, and captions generated successfully.",
+            message=f"{field} regenerated successfully",
         )
-
-        # ⬇️ Save to DB
-        if result.success:
-            await db["tags_captions"].insert_one(result.model_dump())
-        return result
     except Exception as e:
-        return GeneratedContent(
-            success=False, data={}, message=f"Error generating tags/captions: {str(e)}"
+        return RegeneratedContent(
+            success=False, data={}, message=f"Error regenerating {field}: {str(e)}"
         )
 
 
-@app.get("/products/")
-async def get_all_products():
+@app.get("/products/", response_model=ProductsResponse)
+@tracing.traced()
+async def get_all_products(size: int = None):
     """
     Fetch all products from the database.
+    Pass `size` to receive thumbnails instead of full-resolution images.
     """
-    products_cursor = db["product"].find({})
-    products = []
-    async for product in products_cursor:
-        product["_id"] = str(product["_id"])  # Convert ObjectId to string for JSON
-        products.append(product)
-    return {"status": "success", "products": products}
+    # ObjectId and datetime values are handled by ORJSONResponse directly
+    products = await db["product"].find({}).to_list(length=None)
+
+    # Images are stored once in the image store; fill them back in by ID
+    images = await image_store.load_images_base64(
+        (p.get("image_id") for p in products), size
+    )
+    for product in products:
+        if product.get("image_id") in images:
+            product["image_base64"] = images[product["image_id"]]
+    return ORJSONResponse({"status": "success", "products": products})
+
+
+@app.get("/products/search")
+@tracing.traced()
+async def search_products(
+    q: str = "",
+    category: str = None,
+    location: str = None,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=product_search.MAX_PAGE_SIZE),
+):
+    """
+    Full-text search over name, title, story, caption, hashtags and SEO tags,
+    ranked by relevance, with category and location facets. An empty query
+    lists products newest first.
+    """
+    result = await product_search.search(q, category, location, page, page_size)
+    return ORJSONResponse(
+        {"status": "success", "page": page, "page_size": page_size, **result}
+    )
+
+
+@app.get("/products/changes")
+async def product_changes(
+    request: Request,
+    product_id: List[str] = Query(None, description="Only these products"),
+):
+    """
+    Server-sent events for product writes (insert, update, import), so clients
+    can update their view instead of polling /products/. Reconnecting clients
+    send Last-Event-ID to receive the events they missed. A resync event means
+    the client fell behind and should refetch.
+    """
+    events = product_events.subscribe(
+        set(product_id) if product_id else None,
+        request.headers.get("last-event-id"),
+    )
+
+    async def stream():
+        yield b"retry: 3000\n\n"
+        async for event in events:
+            if event is None:
+                yield b": keep-alive\n\n"
+                continue
+            event_id = f"id: {event['id']}\n" if "id" in event else ""
+            yield (
+                f"{event_id}event: {event['operation']}\ndata: ".encode()
+                + dumps(event)
+                + b"\n\n"
+            )
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.websocket("/products/changes/ws")
+async def product_changes_ws(websocket: WebSocket):
+    """The product change feed over a WebSocket, one JSON event per message"""
+    await websocket.accept()
+    product_ids = set(websocket.query_params.getlist("product_id")) or None
+    after = websocket.query_params.get("after")
+    try:
+        async for event in product_events.subscribe(product_ids, after):
+            if event is None:
+                # Heartbeat; also notices clients that went away
+                await websocket.send_text('{"operation": "keep-alive"}')
+                continue
+            await websocket.send_text(dumps(event).decode())
+    except WebSocketDisconnect:
+        return
+    await websocket.close()
+
+
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+@app.get("/products/export")
+async def export_products(
+    format: str = "ndjson", images: bool = False, size: int = None
+):
+    """
+    Stream the whole catalogue as NDJSON (default) or CSV, batch by batch.
+    Images are referenced by image_id; pass images=true (NDJSON only) to inline
+    them as image_base64, optionally as thumbnails of width `size`.
+    """
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+    if format == "csv":
+        body = catalogue.export_csv()
+    else:
+        body = catalogue.export_ndjson(images, size)
+    return StreamingResponse(
+        body,
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="products.{format}"'},
+    )
+
+
+@app.post("/products/import")
+@tracing.traced()
+async def import_products(request: Request, format: str = None):
+    """
+    Import products from an NDJSON or CSV request body (format from the query
+    or the Content-Type). The body is parsed as it streams in and rows are
+    validated against Product and written in batches; rows with an _id update
+    that product. Returns counts and per-row errors.
+    """
+    content_type = request.headers.get("content-type", "")
+    format = format or ("csv" if "csv" in content_type else "ndjson")
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+    report = await catalogue.import_products(request.stream(), format)
+    return {"status": "success", **report}
+
+
+@app.get("/tenants/usage")
+async def get_tenant_usage(
+    period: str = None, tenant: Tenant = Depends(tenants.get_caller)
+):
+    """
+    Usage and budgets of the calling tenant for a month (YYYY-MM, default current).
+    """
+    return await tenants.usage_report(tenant, period)
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics (model routing, latency, tokens)"""
+    return Response(
+        content=metrics.render_prometheus(), media_type="text/plain; version=0.0.4"
+    )
+
+
+@app.get("/traces")
+async def get_traces(request_id: str = None, limit: int = 20):
+    """Recent sampled traces, newest first (TRACE_EXPORTER=memory only)"""
+    if not isinstance(tracing.exporter, tracing.MemoryExporter):
+        raise HTTPException(status_code=404, detail="Traces are not kept in memory")
+    return {"traces": tracing.exporter.recent(request_id, limit)}
 
 
 @app.get("/health")
@@ -322,6 +859,30 @@ async def health_check():
     return {"status": "healthy", "service": "artisan-content-generator"}
 
 
+# Registers the product storage routes on app; imported last because
+# store_into_db_urls imports app from this module
+from store_into_db_urls import *
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 2000))  # Render provides PORT
-    uvicorn.run("server:app", host="0.0.0.0", port=port, reload=False)
+    # One worker per core unless WEB_CONCURRENCY says otherwise. Set
+    # SHARED_STATE_URL so budgets and single-flight span all workers.
+    web_concurrency = int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1))
+    # Workers read it to size their CPU pools (see workers.CPU_POOL_WORKERS)
+    os.environ["WEB_CONCURRENCY"] = str(web_concurrency)
+    if web_concurrency > 1 and not shared_state.backend.shared:
+        print("SHARED_STATE_URL is not set: rate limits and locks are per worker")
+    if web_concurrency > 1 and product_events.CHANGE_FEED == "local":
+        print(
+            "CHANGE_FEED=local: each worker's change feed only shows its own "
+            "writes; set CHANGE_FEED=mongo"
+        )
+    uvicorn.run(
+        "server:app",
+        host="0.0.0.0",
+        port=port,
+        reload=False,
+        workers=web_concurrency,
+        # On SIGTERM, stop accepting and give in-flight requests time to finish
+        timeout_graceful_shutdown=int(SHUTDOWN_TIMEOUT),
+    )
@@ -0,0 +1,180 @@
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import tracing
+
+# redis://host:port/db to share counters, caches and locks between workers.
+# Unset, state is per process, which is only correct with a single worker.
+SHARED_STATE_URL = os.getenv("SHARED_STATE_URL")
+KEY_PREFIX = os.getenv("SHARED_STATE_PREFIX", "artisan:")
+
+
+class MemoryBackend:
+    """Per-process backend; the default for single-worker and local runs"""
+
+    shared = False
+
+    def __init__(self):
+        self._values: Dict[str, Tuple[Any, Optional[float]]] = {}
+
+    def _live(self, key: str) -> Optional[Any]:
+        item = self._values.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._values[key]
+            return None
+        return value
+
+    async def get(self, key: str) -> Optional[str]:
+        return self._live(key)
+
+    async def set(
+        self, key: str, value: str, ttl: float = None, only_if_absent: bool = False
+    ) -> bool:
+        if only_if_absent and self._live(key) is not None:
+            return False
+        expires_at = time.monotonic() + ttl if ttl else None
+        self._values[key] = (value, expires_at)
+        return True
+
+    async def incr(self, key: str, amount: int = 1, ttl: float = None) -> int:
+        value = int(self._live(key) or 0) + amount
+        expires_at = self._values.get(key, (None, None))[1]
+        if expires_at is None and ttl:
+            expires_at = time.monotonic() + ttl
+        self._values[key] = (str(value), expires_at)
+        return value
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._values.pop(key, None)
+
+    async def close(self):
+        pass
+
+
+class RedisBackend:
+    """Backend shared by all workers through Redis (needs the redis package)"""
+
+    shared = True
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(url, decode_responses=True)
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._redis.get(KEY_PREFIX + key)
+
+    async def set(
+        self, key: str, value: str, ttl: float = None, only_if_absent: bool = False
+    ) -> bool:
+        result = await self._redis.set(
+            KEY_PREFIX + key,
+            value,
+            px=int(ttl * 1000) if ttl else None,
+            nx=only_if_absent,
+        )
+        return bool(result)
+
+    async def incr(self, key: str, amount: int = 1, ttl: float = None) -> int:
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.incrby(KEY_PREFIX + key, amount)
+            if ttl:
+                pipe.expire(KEY_PREFIX + key, int(ttl), nx=True)
+            results = await pipe.execute()
+        return int(results[0])
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self._redis.delete(*(KEY_PREFIX + key for key in keys))
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+def create_backend():
+    if SHARED_STATE_URL:
+        return RedisBackend(SHARED_STATE_URL)
+    return MemoryBackend()
+
+
+backend = create_backend()
+
+# Flights started by this process, so local duplicates await the same task
+_flights: Dict[str, asyncio.Future] = {}
+LOCK_POLL_SECONDS = 0.1
+# Seconds a finished flight's result stays available to workers that waited
+RESULT_TTL = 60
+
+
+async def single_flight(
+    key: str,
+    fn: Callable[[], Awaitable[Any]],
+    lock_ttl: float = 120,
+    encode: Callable[[Any], str] = None,
+    decode: Callable[[str], Any] = None,
+) -> Any:
+    """
+    Run fn once for concurrent callers with the same key.
+
+    Within a process, duplicates share the first caller's result. With a
+    shared backend, workers also take a lock. Given encode/decode, the
+    result is published through the backend before the lock is released,
+    so waiting workers reuse it instead of running fn. Without them the next
+    worker runs fn itself, which only helps if fn checks a shared cache first
+    (e.g. Mongo).
+    """
+    if key in _flights:
+        # Another request is already generating this; wait for its result
+        with tracing.span("single_flight.wait", {"single_flight.key": key}):
+            return await asyncio.shield(_flights[key])
+
+    future = asyncio.get_running_loop().create_future()
+    _flights[key] = future
+    lock_key = f"flight:{key}"
+    result_key = f"flight-result:{key}"
+    locked = False
+    try:
+        shared_result = None
+        if backend.shared:
+            deadline = time.monotonic() + lock_ttl
+            while not await backend.set(
+                lock_key, "1", ttl=lock_ttl, only_if_absent=True
+            ):
+                if decode is not None:
+                    shared_result = await backend.get(result_key)
+                    if shared_result is not None:
+                        break
+                if time.monotonic() > deadline:
+                    break
+                await asyncio.sleep(LOCK_POLL_SECONDS)
+            else:
+                locked = True
+                if decode is not None:
+                    # The previous holder may have finished just before we got the lock
+                    shared_result = await backend.get(result_key)
+        if shared_result is not None:
+            result = decode(shared_result)
+        else:
+            result = await fn()
+            if locked and encode is not None:
+                await backend.set(result_key, encode(result), ttl=RESULT_TTL)
+        future.set_result(result)
+        return result
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # Mark the exception as retrieved when nobody else was waiting
+        future.exception()
+        raise
+    finally:
+        del _flights[key]
+        if locked:
+            await backend.delete(lock_key)
@@ -0,0 +1,217 @@
+import asyncio
+import os
+import re
+import time
+import unicodedata
+import zlib
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import metrics
+import tracing
+import workers
+from database import db
+
+ENABLED = os.getenv("SIMILARITY_CACHE", "true").lower() == "true"
+# Estimated Jaccard similarity (0-1) of the request text needed to reuse a result
+THRESHOLD = float(os.getenv("SIMILARITY_CACHE_THRESHOLD", 0.9))
+# Most recent history records per collection kept in the index
+HISTORY_SIZE = int(os.getenv("SIMILARITY_CACHE_SIZE", 5000))
+REFRESH_SECONDS = 300
+# History records whose signatures are computed per CPU pool task on rebuilds
+BUILD_CHUNK = 500
+# Histogram buckets for the similarity of hits and near misses (hit quality)
+SCORE_BUCKETS = (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.99, 1.0)
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+_PRIME = (1 << 61) - 1
+_PERMUTATIONS = [
+    (zlib.crc32(f"a{i}".encode()) | 1, zlib.crc32(f"b{i}".encode()))
+    for i in range(NUM_PERM)
+]
+
+# Per task: which request fields must match exactly, and which are compared by similarity.
+# Stories need the same (normalized) title: artisans reuse one description
+# across products, and a long shared description would outweigh the title.
+TASK_FIELDS = {
+    "titles": (("category", "location"), ("user_title",)),
+    "stories": (("category", "location", "user_title"), ("description",)),
+}
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    """Case-, width-, punctuation- and whitespace-insensitive form of a string"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = _PUNCTUATION.sub(" ", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def shingles(text: str, size: int = 3) -> set:
+    """Character n-grams; robust to plurals and small edits in short titles"""
+    if len(text) <= size:
+        return {text}
+    return {text[i : i + size] for i in range(len(text) - size + 1)}
+
+
+def signature(text: str) -> Tuple[int, ...]:
+    hashes = [zlib.crc32(s.encode("utf-8")) for s in shingles(text)]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def signatures(texts: List[str]) -> List[Tuple[int, ...]]:
+    """Signatures of many texts; runs in the CPU pool"""
+    return [signature(text) for text in texts]
+
+
+def similarity(a: Tuple[int, ...], b: Tuple[int, ...]) -> float:
+    """Estimated Jaccard similarity of two signatures"""
+    return sum(x == y for x, y in zip(a, b)) / NUM_PERM
+
+
+class MinHashIndex:
+    """Locality-sensitive index of request signatures, partitioned by exact-match group"""
+
+    def __init__(self):
+        self.entries: Dict[str, Tuple[str, Tuple[int, ...], Dict[str, Any]]] = {}
+        self.exact: Dict[Tuple[str, str], str] = {}
+        self.buckets: Dict[Tuple[str, int, Tuple[int, ...]], List[str]] = defaultdict(
+            list
+        )
+
+    def add(
+        self,
+        key: str,
+        group: str,
+        text: str,
+        result: Dict[str, Any],
+        sig: Optional[Tuple[int, ...]] = None,
+    ):
+        sig = sig or signature(text)
+        self.entries[key] = (group, sig, result)
+        self.exact[(group, text)] = key
+        for band in range(BANDS):
+            self.buckets[(group, band, sig[band * ROWS : (band + 1) * ROWS])].append(
+                key
+            )
+
+    def query(self, group: str, text: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+        if (group, text) in self.exact:
+            return 1.0, self.entries[self.exact[(group, text)]][2]
+        sig = signature(text)
+        candidates = set()
+        for band in range(BANDS):
+            candidates.update(
+                self.buckets.get(
+                    (group, band, sig[band * ROWS : (band + 1) * ROWS]), ()
+                )
+            )
+        best = None
+        for key in candidates:
+            score = similarity(sig, self.entries[key][1])
+            if best is None or score > best[0]:
+                best = (score, self.entries[key][2])
+        return best
+
+
+_indexes: Dict[str, MinHashIndex] = {}
+_loaded_at: Dict[str, float] = {}
+_building: Dict[str, asyncio.Task] = {}
+# Records added while a rebuild runs, replayed into the new index
+_pending: Dict[str, List[Tuple[str, str, str, Dict[str, Any]]]] = defaultdict(list)
+
+
+def request_key(task: str, request: Dict[str, str]) -> Tuple[str, str]:
+    exact_fields, similar_fields = TASK_FIELDS[task]
+    group = "|".join(normalize(request.get(f, "")) for f in exact_fields)
+    text = " ".join(normalize(request.get(f, "")) for f in similar_fields)
+    return group, text
+
+
+async def _build(task: str):
+    index = MinHashIndex()
+    cursor = (
+        db[task]
+        .find({"success": True, "request": {"$exists": True}})
+        .sort("_id", -1)
+        .limit(HISTORY_SIZE)
+    )
+    entries = []
+    async for record in cursor:
+        group, text = request_key(task, record["request"])
+        result = {**record["data"], "record_id": str(record["_id"])}
+        entries.append((str(record["_id"]), group, text, result))
+    # Signatures are the expensive part; compute them off the event loop
+    for start in range(0, len(entries), BUILD_CHUNK):
+        chunk = entries[start : start + BUILD_CHUNK]
+        sigs = await workers.run_cpu(signatures, [text for _, _, text, _ in chunk])
+        for (key, group, text, result), sig in zip(chunk, sigs):
+            index.add(key, group, text, result, sig)
+    for entry in _pending.pop(task, []):
+        index.add(*entry)
+    _indexes[task] = index
+    _loaded_at[task] = time.monotonic()
+
+
+def _ensure_loaded(task: str) -> Optional[MinHashIndex]:
+    """
+    The current index, or None before the first build finishes. Stale indexes
+    keep serving while a single background rebuild runs.
+    """
+    loaded_at = _loaded_at.get(task)
+    stale = loaded_at is None or time.monotonic() - loaded_at >= REFRESH_SECONDS
+    building = _building.get(task)
+    if stale and (building is None or building.done()):
+        _building[task] = asyncio.create_task(_build(task))
+    return _indexes.get(task)
+
+
+async def lookup(task: str, request: Dict[str, str]) -> Optional[Dict[str, Any]]:
+    """Return a stored result for a similar enough earlier request, if any"""
+    if not ENABLED:
+        return None
+    with tracing.span("cache.lookup", {"cache.name": f"similarity:{task}"}) as span:
+        index = _ensure_loaded(task)
+        group, text = request_key(task, request)
+        match = index.query(group, text) if index is not None else None
+        span.set_attributes(
+            {
+                "cache.hit": match is not None and match[0] >= THRESHOLD,
+                "cache.score": match[0] if match else 0.0,
+            }
+        )
+    if match is None or match[0] < THRESHOLD:
+        metrics.inc("similarity_cache_total", task=task, outcome="miss")
+        if match is not None:
+            metrics.observe(
+                "similarity_cache_near_miss_score",
+                match[0],
+                buckets=SCORE_BUCKETS,
+                task=task,
+            )
+        return None
+    metrics.inc(
+        "similarity_cache_total",
+        task=task,
+        outcome="exact_hit" if (group, text) in index.exact else "similar_hit",
+    )
+    metrics.observe(
+        "similarity_cache_hit_score", match[0], buckets=SCORE_BUCKETS, task=task
+    )
+    return match[1]
+
+
+def add(task: str, record_id: Any, request: Dict[str, str], result: Dict[str, Any]):
+    """Index a freshly stored history record"""
+    if not ENABLED:
+        return
+    group, text = request_key(task, request)
+    building = _building.get(task)
+    if building is not None and not building.done():
+        _pending[task].append((str(record_id), group, text, result))
+    if task in _indexes:
+        _indexes[task].add(str(record_id), group, text, result)
@@ -1,31 +1,78 @@
 from fastapi import FastAPI, Body, HTTPException
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from bson import ObjectId
 from database import db
+from pymongo import ReturnDocument
 import base64, binascii
 from datetime import datetime
 
+import category_classifier
+import image_store
+import product_events
+
 from server import app  # assumes your FastAPI app is defined in server.py
 
 
 # Generic product updater
-async def update_product(product_id: str, fields: Dict[str, Any]):
+async def update_product(
+    product_id: str, fields: Dict[str, Any], version: Optional[int] = None
+) -> int:
+    """
+    Set fields on a product, bumping its version and updated_at, and return
+    the new version. With `version`, the write only applies if the product
+    is still at that version; otherwise it fails with 409 and the current one.
+    """
     try:
-        result = await db["product"].update_one(
-            {"_id": ObjectId(product_id)},
-            {"$set": fields},
-            upsert=False,
+        query = {"_id": ObjectId(product_id)}
+        if version is not None:
+            # Products written before versioning count as version 0
+            query["version"] = {"$in": [0, None]} if version == 0 else version
+        now = datetime.utcnow()
+        updated = await db["product"].find_one_and_update(
+            query,
+            {"$set": {**fields, "updated_at": now}, "$inc": {"version": 1}},
+            projection={"version": 1},
+            return_document=ReturnDocument.AFTER,
         )
-        if result.matched_count == 0:
-            raise HTTPException(status_code=404, detail="Product not found")
-        return result
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"DB update failed: {str(e)}")
+    if updated is None:
+        current = await db["product"].find_one(
+            {"_id": ObjectId(product_id)}, {"version": 1}
+        )
+        if current is None:
+            raise HTTPException(status_code=404, detail="Product not found")
+        raise HTTPException(
+            status_code=409,
+            detail={
+                "message": "Product was changed by another request; reload and retry",
+                "version": current.get("version", 0),
+            },
+        )
+    product_events.publish("update", product_id, fields, updated["version"], now)
+    return updated["version"]
+
+
+async def backfill_product_fields():
+    """Give products created before versioning a version and timestamps"""
+    await db["product"].update_many(
+        {"version": {"$exists": False}},
+        [
+            {
+                "$set": {
+                    "version": 0,
+                    "created_at": {"$ifNull": ["$created_at", "$timestamp", "$$NOW"]},
+                    "updated_at": {"$ifNull": ["$updated_at", "$timestamp", "$$NOW"]},
+                }
+            }
+        ],
+    )
 
 
 # Create a new product
 @app.post("/create_product")
 async def create_product():
+    now = datetime.utcnow()
     new_product = {
         "name": "",
         "category": "",
@@ -37,11 +84,20 @@ async def create_product():
         "hashtags": [],
         "seo_tags": [],
         "image_base64": "",
-        "timestamp": datetime.utcnow(),  # added timestamp
+        "image_id": "",
+        "timestamp": now,  # added timestamp
+        "created_at": now,
+        "updated_at": now,
+        "version": 1,
     }
     try:
         result = await db["product"].insert_one(new_product)
-        return {"status": "success", "product_id": str(result.inserted_id)}
+        product_events.publish("insert", str(result.inserted_id), new_product, 1, now)
+        return {
+            "status": "success",
+            "product_id": str(result.inserted_id),
+            "version": 1,
+        }
     except Exception as e:
         raise HTTPException(
             status_code=400, detail=f"Could not create product: {str(e)}"
@@ -50,25 +106,52 @@ async def create_product():
 
 # Store title
 @app.post("/store_title/")
-async def api_store_title(product_id: str = Body(...), title: str = Body(...)):
-    await update_product(product_id, {"title": title})
-    return {"status": "success"}
+async def api_store_title(
+    product_id: str = Body(...),
+    title: str = Body(...),
+    version: int = Body(None, description="Expected current version (409 if stale)"),
+):
+    version = await update_product(product_id, {"title": title}, version)
+    return {"status": "success", "version": version}
 
 
 # Store story
 @app.post("/store_story/")
-async def api_store_story(product_id: str = Body(...), story: str = Body(...)):
-    await update_product(product_id, {"story": story})
-    return {"status": "success"}
+async def api_store_story(
+    product_id: str = Body(...),
+    story: str = Body(...),
+    version: int = Body(None, description="Expected current version (409 if stale)"),
+):
+    version = await update_product(product_id, {"story": story}, version)
+    return {"status": "success", "version": version}
 
 
-# Store image (base64)
+# Store image (base64 or an existing image ID)
 @app.post("/store_image/")
-async def api_store_image(product_id: str = Body(...), image_base64: str = Body(...)):
+async def api_store_image(
+    product_id: str = Body(...),
+    image_base64: str = Body(None),
+    image_id: str = Body(None),
+    version: int = Body(None, description="Expected current version (409 if stale)"),
+):
     try:
-        base64.b64decode(image_base64)
-        await update_product(product_id, {"image_base64": image_base64})
-        return {"status": "success"}
+        if image_base64:
+            record = await image_store.store_image_base64(image_base64)
+        elif image_id:
+            record = await image_store.get_image(image_id, with_data=False)
+            record["image_id"] = record.pop("_id")
+        else:
+            raise HTTPException(
+                status_code=400, detail="Either image_base64 or image_id is required"
+            )
+        # The bytes live in the image store; the product only keeps a reference
+        version = await update_product(
+            product_id, {"image_id": record["image_id"], "image_base64": ""}, version
+        )
+        await category_classifier.learn_from_product(product_id)
+        return {"status": "success", "image_id": record["image_id"], "version": version}
+    except HTTPException:
+        raise
     except binascii.Error:
         raise HTTPException(status_code=400, detail="Invalid base64 string")
     except Exception as e:
@@ -82,11 +165,14 @@ async def store_name_category_location(
     name: str = Body(...),
     category: str = Body(...),
     location: str = Body(...),
+    version: int = Body(None, description="Expected current version (409 if stale)"),
 ):
-    await update_product(
-        product_id, {"name": name, "category": category, "location": location}
+    version = await update_product(
+        product_id, {"name": name, "category": category, "location": location}, version
     )
-    return {"status": "success"}
+    # User-confirmed categories are training labels for the local classifier
+    await category_classifier.learn_from_product(product_id)
+    return {"status": "success", "version": version}
 
 
 # Store description
@@ -94,9 +180,10 @@ async def store_name_category_location(
 async def store_description(
     product_id: str = Body(...),
     description: str = Body(...),
+    version: int = Body(None, description="Expected current version (409 if stale)"),
 ):
-    await update_product(product_id, {"description": description})
-    return {"status": "success"}
+    version = await update_product(product_id, {"description": description}, version)
+    return {"status": "success", "version": version}
 
 
 # Store caption, hashtags, SEO tags
@@ -106,8 +193,11 @@ async def api_store_caption_hashtags_seo(
     caption: str = Body(...),
     hashtags: List[str] = Body(...),
     seo_tags: List[str] = Body(...),
+    version: int = Body(None, description="Expected current version (409 if stale)"),
 ):
-    await update_product(
-        product_id, {"caption": caption, "hashtags": hashtags, "seo_tags": seo_tags}
+    version = await update_product(
+        product_id,
+        {"caption": caption, "hashtags": hashtags, "seo_tags": seo_tags},
+        version,
     )
-    return {"status": "success"}
+    return {"status": "success", "version": version}
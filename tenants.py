@@ -0,0 +1,246 @@
+import asyncio
+import hashlib
+import os
+import secrets
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import Header, HTTPException
+
+import shared_state
+from database import db
+from modelsDB import Tenant
+
+# Without REQUIRE_API_KEY, requests with no key run as the anonymous tenant,
+# whose budgets come from the environment (0 means unlimited).
+REQUIRE_API_KEY = os.getenv("REQUIRE_API_KEY", "false").lower() == "true"
+ANONYMOUS_REQUEST_BUDGET = int(os.getenv("ANONYMOUS_REQUEST_BUDGET", 0))
+ANONYMOUS_TOKEN_BUDGET = int(os.getenv("ANONYMOUS_TOKEN_BUDGET", 0))
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", 30))
+TENANT_CACHE_TTL = 60
+
+USAGE_FIELDS = ("requests", "prompt_tokens", "output_tokens", "total_tokens")
+# Live counters live in shared_state under usage:<tenant>:<period>:<field>,
+# seeded once from the totals flushed to Mongo
+COUNTER_TTL = 40 * 24 * 3600
+
+ANONYMOUS = Tenant(
+    tenant_id="anonymous",
+    name="anonymous",
+    request_budget=ANONYMOUS_REQUEST_BUDGET,
+    token_budget=ANONYMOUS_TOKEN_BUDGET,
+)
+
+# api key hash -> (tenant, loaded at)
+_tenants: Dict[str, Tuple[Optional[Tenant], float]] = {}
+# (tenant_id, period) -> usage not yet flushed to Mongo
+_pending: Dict[Tuple[str, str], Dict[str, int]] = {}
+_flush_task: Optional[asyncio.Task] = None
+
+
+def hash_api_key(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+def current_period() -> str:
+    """Budgets reset every calendar month (UTC)"""
+    return datetime.utcnow().strftime("%Y-%m")
+
+
+async def create_tenant(
+    name: str, request_budget: int = 0, token_budget: int = 0
+) -> str:
+    """Create a tenant and return its API key; only the key's hash is stored"""
+    api_key = secrets.token_urlsafe(32)
+    tenant = Tenant(
+        tenant_id=secrets.token_hex(8),
+        name=name,
+        request_budget=request_budget,
+        token_budget=token_budget,
+    )
+    await db["tenants"].insert_one(
+        {**tenant.model_dump(), "api_key_hash": hash_api_key(api_key)}
+    )
+    return api_key
+
+
+async def get_tenant(api_key: str) -> Optional[Tenant]:
+    key_hash = hash_api_key(api_key)
+    cached = _tenants.get(key_hash)
+    if cached and time.monotonic() - cached[1] < TENANT_CACHE_TTL:
+        return cached[0]
+    record = await db["tenants"].find_one({"api_key_hash": key_hash, "active": True})
+    tenant = Tenant(**record) if record else None
+    _tenants[key_hash] = (tenant, time.monotonic())
+    return tenant
+
+
+def _counter_prefix(tenant_id: str, period: str) -> str:
+    return f"usage:{tenant_id}:{period}"
+
+
+async def _usage(tenant_id: str, period: str) -> Dict[str, int]:
+    """Live usage for a period, seeding the counters from Mongo on first use"""
+    backend = shared_state.backend
+    prefix = _counter_prefix(tenant_id, period)
+    if await backend.set(f"{prefix}:seeded", "1", ttl=COUNTER_TTL, only_if_absent=True):
+        record = await db["tenant_usage"].find_one(
+            {"tenant_id": tenant_id, "period": period}
+        )
+        for field in USAGE_FIELDS:
+            if record and record.get(field):
+                await backend.incr(f"{prefix}:{field}", record[field], ttl=COUNTER_TTL)
+    return {
+        field: int(await backend.get(f"{prefix}:{field}") or 0)
+        for field in USAGE_FIELDS
+    }
+
+
+async def _add_usage(tenant_id: str, **amounts: int):
+    period = current_period()
+    prefix = _counter_prefix(tenant_id, period)
+    pending = _pending.setdefault((tenant_id, period), {f: 0 for f in USAGE_FIELDS})
+    for field, amount in amounts.items():
+        pending[field] += amount
+        if amount:
+            await shared_state.backend.incr(
+                f"{prefix}:{field}", amount, ttl=COUNTER_TTL
+            )
+
+
+async def get_caller(x_api_key: str = Header(None)) -> Tenant:
+    """Resolve the caller's tenant from the X-API-Key header"""
+    if x_api_key:
+        tenant = await get_tenant(x_api_key)
+        if tenant is None:
+            raise HTTPException(status_code=401, detail="Invalid API key")
+        return tenant
+    if REQUIRE_API_KEY:
+        raise HTTPException(status_code=401, detail="Missing X-API-Key header")
+    return ANONYMOUS
+
+
+async def require_tenant(x_api_key: str = Header(None)) -> Tenant:
+    """
+    Resolve the caller's tenant and reserve one request against its budget.
+    Runs as a dependency, so over-budget calls never reach the model.
+    """
+    tenant = await get_caller(x_api_key)
+    period = current_period()
+    usage = await _usage(tenant.tenant_id, period)
+    if tenant.token_budget and usage["total_tokens"] >= tenant.token_budget:
+        raise HTTPException(status_code=429, detail="Token budget exhausted")
+    # Reserve first and decide on the incremented count, so concurrent
+    # requests cannot all pass a check made before any of them counted
+    key = f"{_counter_prefix(tenant.tenant_id, period)}:requests"
+    requests = await shared_state.backend.incr(key, 1, ttl=COUNTER_TTL)
+    if tenant.request_budget and requests > tenant.request_budget:
+        await shared_state.backend.incr(key, -1, ttl=COUNTER_TTL)
+        raise HTTPException(status_code=429, detail="Request budget exhausted")
+    pending = _pending.setdefault(
+        (tenant.tenant_id, period), {f: 0 for f in USAGE_FIELDS}
+    )
+    pending["requests"] += 1
+    return tenant
+
+
+async def record_usage(tenant: Tenant, response: Any):
+    """Add the token counts from a Gemini response's usage_metadata"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    await _add_usage(
+        tenant.tenant_id,
+        prompt_tokens=usage.prompt_token_count or 0,
+        output_tokens=usage.candidates_token_count or 0,
+        total_tokens=usage.total_token_count or 0,
+    )
+
+
+async def flush_usage():
+    """Write pending usage to Mongo with $inc, so several workers can share totals"""
+    global _pending
+    pending, _pending = _pending, {}
+    for (tenant_id, period), amounts in pending.items():
+        if not any(amounts.values()):
+            continue
+        try:
+            await db["tenant_usage"].update_one(
+                {"tenant_id": tenant_id, "period": period},
+                {"$inc": amounts, "$set": {"updated_at": datetime.utcnow()}},
+                upsert=True,
+            )
+        except Exception:
+            # Keep the counts for the next flush rather than losing them
+            _add_back(tenant_id, period, amounts)
+            continue
+        if not shared_state.backend.shared:
+            # Per-process counters: reseed from Mongo on the next check to
+            # pick up other workers' flushed usage
+            prefix = _counter_prefix(tenant_id, period)
+            await shared_state.backend.delete(
+                f"{prefix}:seeded", *(f"{prefix}:{f}" for f in USAGE_FIELDS)
+            )
+
+
+def _add_back(tenant_id: str, period: str, amounts: Dict[str, int]):
+    pending = _pending.setdefault((tenant_id, period), {f: 0 for f in USAGE_FIELDS})
+    for field, amount in amounts.items():
+        pending[field] += amount
+
+
+async def _flush_periodically():
+    while True:
+        await asyncio.sleep(USAGE_FLUSH_INTERVAL)
+        await flush_usage()
+
+
+def start_flusher():
+    global _flush_task
+    if _flush_task is None:
+        _flush_task = asyncio.create_task(_flush_periodically())
+
+
+async def stop_flusher():
+    global _flush_task
+    if _flush_task is not None:
+        _flush_task.cancel()
+        _flush_task = None
+    await flush_usage()
+
+
+async def usage_report(tenant: Tenant, period: Optional[str] = None) -> Dict[str, Any]:
+    period = period or current_period()
+    usage = await _usage(tenant.tenant_id, period)
+    return {
+        "tenant_id": tenant.tenant_id,
+        "name": tenant.name,
+        "period": period,
+        "usage": usage,
+        "budgets": {
+            "requests": tenant.request_budget,
+            "tokens": tenant.token_budget,
+        },
+    }
+
+
+async def ensure_indexes():
+    await db["tenants"].create_index("api_key_hash", unique=True)
+    await db["tenant_usage"].create_index(
+        [("tenant_id", 1), ("period", 1)], unique=True
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Create an API tenant")
+    parser.add_argument("name")
+    parser.add_argument(
+        "--requests", type=int, default=0, help="Monthly request budget"
+    )
+    parser.add_argument("--tokens", type=int, default=0, help="Monthly token budget")
+    args = parser.parse_args()
+    key = asyncio.run(create_tenant(args.name, args.requests, args.tokens))
+    print(f"API key for {args.name}: {key}")
@@ -0,0 +1,323 @@
+import functools
+import json
+import os
+import random
+import re
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+# memory keeps recent traces for GET /traces, console prints one JSON line per
+# span, otel hands spans to the OpenTelemetry API (needs opentelemetry-api and
+# an SDK configured by the deployment), none disables tracing.
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "memory").lower()
+# Share of requests traced; requests with a traceparent header follow its flag
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0.1))
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", 200))
+
+REQUEST_ID_HEADER = "x-request-id"
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,128}$")
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+class Span:
+    """A timed stage of a request, shaped like an OpenTelemetry span"""
+
+    __slots__ = (
+        "name",
+        "trace",
+        "span_id",
+        "parent_id",
+        "start_ns",
+        "end_ns",
+        "attributes",
+        "error",
+    )
+
+    def __init__(self, name: str, trace: "Trace", parent_id: Optional[str]):
+        self.name = name
+        self.trace = trace
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes: Dict[str, Any] = {}
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes: Dict[str, Any]):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "request_id": self.trace.request_id,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_ms": (self.end_ns - self.start_ns) / 1e6,
+            "attributes": self.attributes,
+            "status": "ERROR" if self.error else "OK",
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+    """Stands in for a span when the request is not sampled"""
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def set_attributes(self, attributes: Dict[str, Any]):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    def __init__(self, request_id: str, trace_id: str, remote_parent_id: str = None):
+        self.request_id = request_id
+        self.trace_id = trace_id
+        self.remote_parent_id = remote_parent_id
+        self.spans: List[Span] = []
+
+
+class MemoryExporter:
+    """Keeps the most recent traces in memory"""
+
+    def __init__(self, size: int = TRACE_BUFFER_SIZE):
+        self.traces: Deque[List[Dict[str, Any]]] = deque(maxlen=size)
+
+    def export(self, trace: Trace):
+        self.traces.append([span.to_dict() for span in trace.spans])
+
+    def recent(self, request_id: str = None, limit: int = 20):
+        traces = [
+            t
+            for t in self.traces
+            if request_id is None or t[0]["request_id"] == request_id
+        ]
+        return traces[-limit:][::-1]
+
+
+class ConsoleExporter:
+    def export(self, trace: Trace):
+        for span in trace.spans:
+            print(json.dumps(span.to_dict(), default=str))
+
+
+class OpenTelemetryExporter:
+    """Replays finished spans through the OpenTelemetry API, keeping their timing"""
+
+    def __init__(self):
+        from opentelemetry import trace as otel_trace
+
+        self._otel = otel_trace
+        self._tracer = otel_trace.get_tracer("artisan-content-generator")
+
+    def export(self, trace: Trace):
+        otel = self._otel
+        created = {}
+        for span in sorted(trace.spans, key=lambda s: s.start_ns):
+            if span.parent_id in created:
+                parent = created[span.parent_id]
+            elif trace.remote_parent_id:
+                parent = otel.NonRecordingSpan(
+                    otel.SpanContext(
+                        trace_id=int(trace.trace_id, 16),
+                        span_id=int(trace.remote_parent_id, 16),
+                        is_remote=True,
+                        trace_flags=otel.TraceFlags(otel.TraceFlags.SAMPLED),
+                    )
+                )
+            else:
+                parent = None
+            context = otel.set_span_in_context(parent) if parent else None
+            created[span.span_id] = self._tracer.start_span(
+                span.name,
+                context=context,
+                start_time=span.start_ns,
+                attributes={"request_id": trace.request_id, **span.attributes},
+            )
+            if span.error:
+                created[span.span_id].set_status(
+                    otel.Status(otel.StatusCode.ERROR, span.error)
+                )
+        for span in trace.spans:
+            created[span.span_id].end(end_time=span.end_ns)
+
+
+def create_exporter():
+    if TRACE_EXPORTER == "none":
+        return None
+    if TRACE_EXPORTER == "console":
+        return ConsoleExporter()
+    if TRACE_EXPORTER == "otel":
+        try:
+            return OpenTelemetryExporter()
+        except ImportError:
+            print("opentelemetry-api is not installed; keeping traces in memory")
+    return MemoryExporter()
+
+
+exporter = create_exporter()
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+_request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+
+def request_id() -> Optional[str]:
+    """ID of the request being handled, also returned in the X-Request-ID header"""
+    return _request_id.get()
+
+
+def current_span():
+    return _current_span.get() or NOOP_SPAN
+
+
+def _start(span: Span) -> Any:
+    span.trace.spans.append(span)
+    return _current_span.set(span)
+
+
+def _finish(span: Span, token: Any, error: Optional[BaseException]):
+    span.end_ns = time.time_ns()
+    if error is not None:
+        span.error = f"{type(error).__name__}: {error}"
+    _current_span.reset(token)
+
+
+@contextmanager
+def span(name: str, attributes: Dict[str, Any] = None):
+    """
+    Time a stage of the current request. Outside a sampled request this
+    yields a no-op span, so instrumented code costs almost nothing.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield NOOP_SPAN
+        return
+    child = Span(name, parent.trace, parent.span_id)
+    if attributes:
+        child.attributes.update(attributes)
+    token = _start(child)
+    error = None
+    try:
+        yield child
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _finish(child, token, error)
+
+
+def traced(name: str = None) -> Callable:
+    """Decorator wrapping an async function (e.g. an endpoint) in a span"""
+
+    def decorator(fn: Callable) -> Callable:
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with span(span_name):
+                return await fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _header(scope: Dict[str, Any], name: bytes) -> Optional[str]:
+    for key, value in scope.get("headers", ()):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware that assigns every request an ID (reusing a valid incoming
+    X-Request-ID), samples it, and opens the root span the stage spans nest under.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = _header(scope, REQUEST_ID_HEADER.encode())
+        rid = incoming if incoming and _VALID_REQUEST_ID.match(incoming) else None
+        rid = rid or uuid.uuid4().hex
+        rid_token = _request_id.set(rid)
+
+        parent = _TRACEPARENT.match(_header(scope, b"traceparent") or "")
+        if parent:
+            sampled = bool(int(parent.group(3), 16) & 1)
+        else:
+            sampled = random.random() < TRACE_SAMPLE_RATE
+        root = None
+        if exporter is not None and sampled:
+            trace = Trace(
+                rid,
+                parent.group(1) if parent else f"{random.getrandbits(128):032x}",
+                parent.group(2) if parent else None,
+            )
+            root = Span(
+                f"{scope['method']} {scope['path']}", trace, trace.remote_parent_id
+            )
+            root.set_attributes(
+                {"http.request.method": scope["method"], "url.path": scope["path"]}
+            )
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((REQUEST_ID_HEADER.encode(), rid.encode()))
+                if root is not None:
+                    root.set_attribute("http.response.status_code", message["status"])
+                    headers.append(
+                        (
+                            b"traceparent",
+                            f"00-{root.trace.trace_id}-{root.span_id}-01".encode(),
+                        )
+                    )
+                message = {**message, "headers": headers}
+            await send(message)
+
+        if root is None:
+            try:
+                await self.app(scope, receive, send_with_headers)
+            finally:
+                _request_id.reset(rid_token)
+            return
+
+        token = _start(root)
+        error = None
+        try:
+            await self.app(scope, receive, send_with_headers)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _finish(root, token, error)
+            _request_id.reset(rid_token)
+            # Name the root span by route template to keep span names low-cardinality
+            route = scope.get("route")
+            if route is not None and hasattr(route, "path"):
+                root.name = f"{scope['method']} {route.path}"
+                root.set_attribute("http.route", route.path)
+            try:
+                exporter.export(root.trace)
+            except Exception as e:
+                print(f"Trace export failed: {e}")
@@ -0,0 +1,81 @@
+import asyncio
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from fastapi import HTTPException
+
+import tracing
+
+# "process" sidesteps the GIL for pure-Python work; "thread" avoids pickling
+# large buffers and is enough for work that releases the GIL (PIL decode, hashlib).
+CPU_POOL_KIND = os.getenv("CPU_POOL_KIND", "process")
+# The cores are shared between the uvicorn workers, so each gets its share
+CPU_POOL_WORKERS = int(
+    os.getenv(
+        "CPU_POOL_WORKERS",
+        max(1, (os.cpu_count() or 1) // int(os.getenv("WEB_CONCURRENCY", 1))),
+    )
+)
+# Tasks allowed to be running or waiting in the pool at once. Callers beyond
+# this wait up to CPU_POOL_QUEUE_TIMEOUT seconds, then get a 503.
+CPU_POOL_QUEUE = int(os.getenv("CPU_POOL_QUEUE", CPU_POOL_WORKERS * 4))
+CPU_POOL_QUEUE_TIMEOUT = float(os.getenv("CPU_POOL_QUEUE_TIMEOUT", 30))
+
+_pool: Optional[Executor] = None
+_slots: Optional[asyncio.Semaphore] = None
+_slots_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def configure(kind: str = None, workers: int = None, queue: int = None):
+    """Replace the pool settings (e.g. from a benchmark); shuts down any existing pool"""
+    global CPU_POOL_KIND, CPU_POOL_WORKERS, CPU_POOL_QUEUE, _slots
+    shutdown()
+    CPU_POOL_KIND = kind or CPU_POOL_KIND
+    CPU_POOL_WORKERS = workers or CPU_POOL_WORKERS
+    CPU_POOL_QUEUE = queue or CPU_POOL_WORKERS * 4
+    _slots = None
+
+
+def get_pool() -> Executor:
+    global _pool
+    if _pool is None:
+        if CPU_POOL_KIND == "thread":
+            _pool = ThreadPoolExecutor(max_workers=CPU_POOL_WORKERS)
+        else:
+            _pool = ProcessPoolExecutor(max_workers=CPU_POOL_WORKERS)
+    return _pool
+
+
+async def run_cpu(fn: Callable[..., Any], *args: Any) -> Any:
+    """
+    Run a CPU-bound function in the shared pool without blocking the event loop.
+    With a process pool, fn must be a module-level function and its arguments
+    and return value must be picklable.
+    """
+    global _slots, _slots_loop
+    loop = asyncio.get_running_loop()
+    if _slots is None or _slots_loop is not loop:
+        _slots, _slots_loop = asyncio.Semaphore(CPU_POOL_QUEUE), loop
+    slots = _slots
+    with tracing.span("cpu_pool", {"code.function": fn.__name__}) as span:
+        queued_at = time.perf_counter()
+        try:
+            await asyncio.wait_for(slots.acquire(), CPU_POOL_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="Server busy, try again later")
+        span.set_attribute(
+            "cpu_pool.queued_ms", (time.perf_counter() - queued_at) * 1e3
+        )
+        try:
+            return await loop.run_in_executor(get_pool(), fn, *args)
+        finally:
+            slots.release()
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None